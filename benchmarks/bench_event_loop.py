@@ -0,0 +1,58 @@
+"""Wall-clock comparison of blocking vs non-blocking image processing.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_event_loop --images 50 --vision-latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from photolocationfinder import ImageProcessor
+from benchmarks.stubs import UNLIMITED_API_LIMITS, StubSession, StubVisionClient, make_sample_images
+
+
+class InlineImageProcessor(ImageProcessor):
+    # Reproduces the old behaviour: file reads and EXIF decoding on the event loop thread
+    async def run_in_executor(self, func, *args):
+        return func(*args)
+
+
+async def run(processor_cls, image_dir, blocking, args):
+    processor = processor_cls("stub-key", os.devnull, image_dir, prompt_for_confirmation=False,
+                              io_workers=args.io_workers, api_limits=UNLIMITED_API_LIMITS,
+                              progress_interval=0)
+    processor.client = StubVisionClient(latency=args.vision_latency, blocking=blocking)
+    processor.session = StubSession(latency=args.maps_latency)
+    start = time.perf_counter()
+    await processor.process_images()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--vision-latency", type=float, default=0.2)
+    parser.add_argument("--maps-latency", type=float, default=0.05)
+    parser.add_argument("--io-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_dir = os.path.join(workdir, "images")
+        make_sample_images(image_dir, args.images)
+        os.chdir(workdir)
+
+        before = asyncio.run(run(InlineImageProcessor, image_dir, True, args))
+        after = asyncio.run(run(ImageProcessor, image_dir, False, args))
+
+    print()
+    print(f"{'mode':<12}{'wall clock (s)':>16}{'images/s':>12}")
+    print(f"{'blocking':<12}{before:>16.2f}{args.images / before:>12.1f}")
+    print(f"{'async':<12}{after:>16.2f}{args.images / after:>12.1f}")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Vision latency and response size for each feature profile.
+
+Run from the repository root against the stubbed Vision client:
+
+    python -m benchmarks.bench_feature_profiles --images 20
+
+or against the real API with the credentials from a config file:
+
+    python -m benchmarks.bench_feature_profiles --live --config config.json --image-dir path/to/photos
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from google.cloud.vision_v1 import types
+
+from photolocationfinder import VISION_FEATURE_PROFILES, ImageProcessor
+from benchmarks.stubs import UNLIMITED_API_LIMITS, StubSession, StubVisionClient, make_sample_images
+
+
+async def measure_profile(profile, image_files, args, config):
+    processor = ImageProcessor(config.get("google_api_key", "stub-key"),
+                               config.get("google_application_credentials_file_path", os.devnull),
+                               args.image_dir, prompt_for_confirmation=False, feature_profile=profile,
+                               api_limits=None if args.live else UNLIMITED_API_LIMITS, progress_interval=0,
+                               result_store_path=None)
+    if not args.live:
+        processor.client = StubVisionClient(latency=args.vision_latency, latency_per_feature=args.feature_latency)
+        processor.session = StubSession(latency=0)
+    await processor.initialize()
+
+    latencies = []
+    sizes = []
+    try:
+        for image_file in image_files:
+            content, _ = processor.read_image_file(image_file)
+            request = processor.build_annotate_request(content)
+            start = time.perf_counter()
+            response = await processor.annotate_image(request)
+            latencies.append(time.perf_counter() - start)
+            sizes.append(len(types.AnnotateImageResponse.serialize(response)))
+    finally:
+        await processor.close()
+    return latencies, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=20, help="number of generated sample images (stub mode)")
+    parser.add_argument("--image-dir", help="directory of photos to annotate (defaults to generated samples)")
+    parser.add_argument("--live", action="store_true", help="call the real Vision API")
+    parser.add_argument("--config", default="config.json", help="configuration file used in live mode")
+    parser.add_argument("--vision-latency", type=float, default=0.15)
+    parser.add_argument("--feature-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    config = {}
+    if args.live:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.image_dir:
+            args.image_dir = os.path.join(workdir, "images")
+            make_sample_images(args.image_dir, args.images, size=(640, 480))
+        image_files = sorted(
+            os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir)
+            if name.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+
+        rows = []
+        for profile in VISION_FEATURE_PROFILES:
+            latencies, sizes = asyncio.run(measure_profile(profile, image_files, args, config))
+            rows.append((profile, len(VISION_FEATURE_PROFILES[profile]), latencies, sizes))
+
+    print(f"{'profile':<18}{'features':>9}{'p50 ms':>10}{'p95 ms':>10}{'mean bytes':>12}")
+    for profile, feature_count, latencies, sizes in rows:
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        p95 = latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.95))]
+        print(f"{profile:<18}{feature_count:>9}{statistics.median(latencies_ms):>10.1f}{p95:>10.1f}"
+              f"{statistics.mean(sizes):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Memory per image, extraction time and Places query size for OCR-heavy photos.
+
+Synthesized Vision responses of document and signage photos with a growing number
+of words are run through every ocr_format and compared with the previous extraction
+(a dict per word, read through the proto-plus wrappers, with every word in the Places
+query). The text search goes to the local Maps stub server.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ocr_text --words 500 --words 5000 --words 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+from google.cloud.vision_v1 import types
+
+from ocr_text import OCR_FORMATS, extract_ocr_text, select_location_text, words_with_boxes
+from photolocationfinder import ImageProcessor
+from benchmarks.stub_server import StubMapsServer
+from benchmarks.stubs import StubVisionClient, make_document_text_annotation
+
+# Lines of a menu board or information sign; only a few of them say where the photo was taken
+DOCUMENT_LINES = [
+    "Café Crème 3,50 € Croissant 2,10 € Tartine 4,80 €",
+    "Open daily 9:00 - 23:45 except holidays",
+    "Tel +33 1 45 55 12 34 www.example-bistro.com",
+    "Please wait to be seated by our staff",
+    "Formule midi entrée plat dessert 18,90 €",
+    "12 Rue Cler 75007 Paris",
+    "Wifi password bistro2024 ask at the counter",
+    "Musée d'Orsay 10 min walk Tour Eiffel 15 min",
+]
+
+
+def make_document_response(words):
+    paragraphs = []
+    count = 0
+    while count < words:
+        line = DOCUMENT_LINES[len(paragraphs) % len(DOCUMENT_LINES)]
+        paragraphs.append(line)
+        count += len(line.split())
+    response = types.AnnotateImageResponse()
+    response.full_text_annotation = make_document_text_annotation(paragraphs)
+    return response
+
+
+def previous_extraction(response):
+    coordinates = []
+    for page in response.full_text_annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    coords = [(vertex.x, vertex.y) for vertex in word.bounding_box.vertices]
+                    coordinates.append({'text': ''.join([symbol.text for symbol in word.symbols]), 'coords': coords})
+    return {"text_coordinates": coordinates}, " ".join(item["text"] for item in coordinates)
+
+
+def extraction(ocr_format, max_chars):
+    def extract(response):
+        ocr_text, boxes = extract_ocr_text(response, with_boxes=ocr_format != "none")
+        if ocr_format == "compact":
+            result = {"ocr_text": {"text": ocr_text, "boxes": boxes}}
+        elif ocr_format == "words":
+            result = {"text_coordinates": words_with_boxes(ocr_text, boxes)}
+        else:
+            result = {}
+        return result, select_location_text(ocr_text, max_chars)
+    return extract
+
+
+def retained_bytes(extract, responses):
+    # What the results of a batch keep alive until they are written, per image
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [extract(response)[0] for response in responses]
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del results
+    return retained / len(responses)
+
+
+async def query_latencies(processor, queries):
+    await processor.initialize()
+    latencies = []
+    try:
+        for query in queries:
+            start = time.perf_counter()
+            await processor.get_location_from_google_maps_api([{"label": query}])
+            latencies.append(time.perf_counter() - start)
+    finally:
+        await processor.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, action="append", help="OCR words per image, may be repeated")
+    parser.add_argument("--images", type=int, default=10, help="images per size")
+    parser.add_argument("--max-chars", type=int, default=150, help="location_text_max_chars")
+    parser.add_argument("--maps-latency", type=float, default=0.05, help="stub Places latency in seconds")
+    args = parser.parse_args()
+
+    server = StubMapsServer(latency=args.maps_latency).start()
+    variants = [("previous", previous_extraction)] + [
+        (ocr_format, extraction(ocr_format, args.max_chars)) for ocr_format in OCR_FORMATS
+    ]
+    print(f"{'words':>7}  {'format':<10}{'extract ms':>11}{'KB/image':>10}{'JSON KB':>9}"
+          f"{'query chars':>13}{'query ms':>10}")
+    try:
+        for words in args.words or [500, 5000, 20000]:
+            responses = [make_document_response(words) for _ in range(args.images)]
+            for name, extract in variants:
+                timings = []
+                for response in responses:
+                    start = time.perf_counter()
+                    result, query = extract(response)
+                    timings.append(time.perf_counter() - start)
+                processor = ImageProcessor("stub-key", os.devnull, ".", prompt_for_confirmation=False,
+                                           progress_interval=0, result_store_path=None,
+                                           maps_api_url=server.maps_api_url, places_api_url=server.places_api_url)
+                processor.client = StubVisionClient()
+                latencies = asyncio.run(query_latencies(processor, [query] * args.images))
+                print(f"{words:>7}  {name:<10}{statistics.median(timings) * 1000:>11.1f}"
+                      f"{retained_bytes(extract, responses) / 1024:>10.0f}{len(json.dumps(result)) / 1024:>9.0f}"
+                      f"{len(query):>13}{statistics.median(latencies) * 1000:>10.1f}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Bytes uploaded, end-to-end latency and label/landmark recall for different downscaling settings.
+
+Run from the repository root against the stubbed Vision client (simulated upload bandwidth):
+
+    python -m benchmarks.bench_preprocessing --images 6
+
+or against the real API on a fixed sample set, which is what makes the recall column meaningful:
+
+    python -m benchmarks.bench_preprocessing --live --config config.json --image-dir path/to/samples
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from photolocationfinder import ImageProcessor
+from benchmarks.stubs import UNLIMITED_API_LIMITS, StubSession, StubVisionClient, make_sample_images
+
+
+class CountingImageProcessor(ImageProcessor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bytes_sent = 0
+
+    def build_annotate_request(self, content, feature_types=None):
+        self.bytes_sent += len(content)
+        return super().build_annotate_request(content, feature_types)
+
+
+def detected_terms(result_path):
+    terms = {}
+    with open(result_path) as f:
+        for line in f:
+            result = json.loads(line)
+            terms[result["filename"]] = (
+                {label["label"] for label in result.get("labels", [])}
+                | {landmark["name"] for landmark in result.get("landmarks", [])}
+            )
+    return terms
+
+
+def recall(baseline, terms):
+    expected = sum(len(values) for values in baseline.values())
+    found = sum(len(values & terms.get(filename, set())) for filename, values in baseline.items())
+    return found / expected if expected else 1.0
+
+
+async def run(max_edge, result_path, args, config):
+    processor = CountingImageProcessor(
+        config.get("google_api_key", "stub-key"),
+        config.get("google_application_credentials_file_path", os.devnull),
+        args.image_dir, prompt_for_confirmation=False, max_image_edge=max_edge, jpeg_quality=args.quality,
+        api_limits=None if args.live else UNLIMITED_API_LIMITS, progress_interval=0,
+        result_path=result_path, result_store_path=None, street_view_mode="lazy"
+    )
+    if not args.live:
+        processor.client = StubVisionClient(latency=args.vision_latency,
+                                            upload_bytes_per_second=args.upload_mbps * 125000)
+        processor.session = StubSession(latency=0)
+    start = time.perf_counter()
+    await processor.process_images()
+    return time.perf_counter() - start, processor.bytes_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=6, help="number of generated sample images (stub mode)")
+    parser.add_argument("--image-dir", help="directory of sample photos (defaults to generated 12 MP images)")
+    parser.add_argument("--edges", default="0,3072,2048,1600,1024,640",
+                        help="comma separated max_image_edge values, 0 uploads the original file")
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--live", action="store_true", help="call the real Google APIs")
+    parser.add_argument("--config", default="config.json", help="configuration file used in live mode")
+    parser.add_argument("--vision-latency", type=float, default=0.2)
+    parser.add_argument("--upload-mbps", type=float, default=20, help="simulated upload bandwidth in Mbit/s")
+    args = parser.parse_args()
+
+    config = {}
+    if args.live:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.image_dir:
+            args.image_dir = os.path.join(workdir, "images")
+            make_sample_images(args.image_dir, args.images, size=(4000, 3000))
+        args.image_dir = os.path.abspath(args.image_dir)
+        os.chdir(workdir)
+
+        baseline = None
+        for edge in (int(value) for value in args.edges.split(",")):
+            result_path = os.path.join(workdir, f"result_{edge}.jsonl")
+            elapsed, bytes_sent = asyncio.run(run(edge or None, result_path, args, config))
+            terms = detected_terms(result_path)
+            if baseline is None:
+                baseline = terms
+            rows.append((edge or "original", bytes_sent, elapsed, recall(baseline, terms)))
+
+    print(f"{'max edge':<10}{'MB sent':>10}{'seconds':>10}{'recall':>10}")
+    for edge, bytes_sent, elapsed, edge_recall in rows:
+        print(f"{str(edge):<10}{bytes_sent / 1e6:>10.1f}{elapsed:>10.2f}{edge_recall:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Images/s, per-image latency, API calls and peak memory against stubbed Google APIs.
+
+Every scenario runs in a fresh process against the local Maps stub server
+(benchmarks/stub_server.py) and the fake Vision client, either through
+ImageProcessor.process_images ("cli") or through the web app's job queue ("web").
+Nothing is sent to Google, so the numbers can be compared between commits.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_replay --images 40
+    python -m benchmarks.bench_replay --scenario throttled --target web --json replay.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.stub_server import DEFAULT_RECORDING_PATH, ENDPOINTS, StubMapsServer
+from benchmarks.stubs import UNLIMITED_API_LIMITS, StubVisionClient, load_vision_recording, make_sample_images
+
+# Latencies in seconds, error and rate limit rates as the fraction of requests that fail
+SCENARIOS = {
+    "baseline": {"vision_latency": 0.2, "maps_latency": 0.05},
+    "slow-maps": {"vision_latency": 0.2, "maps_latency": 0.5},
+    "flaky": {"vision_latency": 0.2, "maps_latency": 0.05, "error_rate": 0.05},
+    "throttled": {"vision_latency": 0.2, "maps_latency": 0.05, "rate_limit_rate": 0.05},
+}
+TARGETS = ("cli", "web")
+API_COLUMNS = {"vision": "vision", "geocode": "geocode", "place_details": "details",
+               "places_text_search": "text search", "street_view": "street view"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def processor_options(server, args):
+    return {
+        "api_key": "stub-key",
+        "maps_api_url": server.maps_api_url,
+        "places_api_url": server.places_api_url,
+        "batch_size": args["batch_size"],
+        "api_limits": UNLIMITED_API_LIMITS if args["unlimited"] else None,
+        "street_view_mode": args["street_view_mode"],
+        "max_image_edge": args["max_image_edge"],
+    }
+
+
+async def run_cli(image_dir, server, vision, args):
+    from photolocationfinder import ImageProcessor
+
+    class TimedImageProcessor(ImageProcessor):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.latencies = []
+
+        async def process_image(self, image_path, feature_profile=None):
+            start = time.perf_counter()
+            try:
+                return await super().process_image(image_path, feature_profile)
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+
+        async def process_image_batch(self, image_paths, feature_profile=None):
+            start = time.perf_counter()
+            try:
+                return await super().process_image_batch(image_paths, feature_profile)
+            finally:
+                self.latencies.extend([time.perf_counter() - start] * len(image_paths))
+
+    options = processor_options(server, args)
+    processor = TimedImageProcessor(
+        options.pop("api_key"), os.devnull, image_dir, prompt_for_confirmation=False, progress_interval=0,
+        result_path="result.jsonl", **options
+    )
+    processor.client = vision
+    await processor.initialize()
+    limiters = processor.scheduler.limiters
+    start = time.perf_counter()
+    await processor.process_images()
+    elapsed = time.perf_counter() - start
+    with open("result.jsonl") as f:
+        failed = sum(1 for line in f if "error" in json.loads(line))
+    return elapsed, processor.latencies, failed, limiters
+
+
+def run_web(image_dir, server, vision, args):
+    options = processor_options(server, args)
+    config = {
+        "google_api_key": options["api_key"],
+        "google_application_credentials_file_path": os.devnull,
+        "image_directory_path": image_dir,
+        "maps_api_url": options["maps_api_url"],
+        "places_api_url": options["places_api_url"],
+        "vision_batch_size": options["batch_size"],
+        "street_view_mode": options["street_view_mode"],
+    }
+    with open("config.json", "w") as f:
+        json.dump(config, f)
+    os.makedirs("uploads")
+    # web_app reads config.json from the working directory when it is imported
+    import web_app
+    from job_queue import FINISHED_STATUSES
+
+    create_processor = web_app.create_processor
+
+    def create_stubbed_processor():
+        processor = create_processor()
+        processor.client = vision
+        processor.api_limits = options["api_limits"]
+        processor.max_image_edge = options["max_image_edge"]
+        return processor
+
+    web_app.create_processor = create_stubbed_processor
+    client = web_app.app.test_client()
+    queue = web_app.get_job_queue()
+    image_files = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))
+
+    start = time.perf_counter()
+    job_ids = []
+    for image_file in image_files:
+        with open(image_file, "rb") as f:
+            response = client.post("/jobs", data={"file": (f, os.path.basename(image_file))},
+                                   content_type="multipart/form-data")
+        job_ids.append(response.get_json()["id"])
+    jobs = []
+    for job_id in job_ids:
+        job = queue.get(job_id)
+        while job["status"] not in FINISHED_STATUSES:
+            job = queue.wait_for_change(job_id, job["status"], timeout=60)
+        jobs.append(job)
+    elapsed = time.perf_counter() - start
+
+    latencies = [job["finished_at"] - job["created_at"] for job in jobs]
+    failed = sum(1 for job in jobs if job["status"] != "done")
+    limiters = queue.processor.scheduler.limiters
+    queue.shutdown()
+    return elapsed, latencies, failed, limiters
+
+
+def run_scenario(scenario, target, image_dir, args):
+    settings = SCENARIOS[scenario]
+    server = StubMapsServer(args["maps_recording"], latency=settings["maps_latency"], jitter=args["jitter"],
+                            error_rate=settings.get("error_rate", 0.0),
+                            rate_limit_rate=settings.get("rate_limit_rate", 0.0)).start()
+    vision = StubVisionClient(
+        latency=settings["vision_latency"], jitter=args["jitter"], error_rate=settings.get("error_rate", 0.0),
+        rate_limit_rate=settings.get("rate_limit_rate", 0.0), without_landmark_every=3,
+        responses=load_vision_recording(args["vision_recording"]) if args["vision_recording"] else None
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            if target == "cli":
+                elapsed, latencies, failed, limiters = asyncio.run(run_cli(image_dir, server, vision, args))
+            else:
+                elapsed, latencies, failed, limiters = run_web(image_dir, server, vision, args)
+        finally:
+            server.stop()
+
+    maps = server.summary()
+    return {
+        "scenario": scenario,
+        "target": target,
+        "images": len(latencies),
+        "failed": failed,
+        "seconds": elapsed,
+        "images_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {name: percentile(latencies, fraction) * 1000
+                       for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "api_calls": dict({"vision": vision.requests}, **{endpoint: maps[endpoint]["calls"] for endpoint in ENDPOINTS}),
+        "throttled": vision.throttled + sum(values["throttled"] for values in maps.values()),
+        "errors": vision.errors + sum(values["errors"] for values in maps.values()),
+        "client_backoffs": sum(limiter.throttled for limiter in limiters.values()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=40, help="number of generated sample images")
+    parser.add_argument("--image-size", default="1024x768", help="size of the generated images")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--target", action="append", choices=TARGETS,
+                        help="code path to measure, may be repeated (default: both)")
+    parser.add_argument("--batch-size", type=int, default=1, help="vision_batch_size for the processor")
+    parser.add_argument("--street-view-mode", default="file", choices=("inline", "file", "lazy"))
+    parser.add_argument("--max-image-edge", type=int, help="downscale images before upload")
+    parser.add_argument("--unlimited", action="store_true",
+                        help="lift the default per-API limits to measure the pipeline alone")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random +/- seconds added to every stub latency")
+    parser.add_argument("--maps-recording", default=str(DEFAULT_RECORDING_PATH),
+                        help="JSON file of recorded Maps responses")
+    parser.add_argument("--vision-recording", help="JSON list of recorded AnnotateImageResponse objects")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.image_size.split("x"))
+    options = {
+        "batch_size": args.batch_size,
+        "street_view_mode": args.street_view_mode,
+        "max_image_edge": args.max_image_edge,
+        "unlimited": args.unlimited,
+        "jitter": args.jitter,
+        "maps_recording": os.path.abspath(args.maps_recording),
+        "vision_recording": os.path.abspath(args.vision_recording) if args.vision_recording else None,
+    }
+
+    rows = []
+    with tempfile.TemporaryDirectory() as image_root:
+        image_dir = os.path.join(image_root, "images")
+        make_sample_images(image_dir, args.images, size=(width, height))
+        for scenario in args.scenario or SCENARIOS:
+            for target in args.target or TARGETS:
+                # A fresh process per run keeps peak RSS and module state from leaking between scenarios
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    rows.append(pool.submit(run_scenario, scenario, target, image_dir, options).result())
+
+    print()
+    print(f"{'scenario':<12}{'target':<8}{'images':>8}{'failed':>8}{'img/s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'peak MB':>9}")
+    for row in rows:
+        latency = row["latency_ms"]
+        print(f"{row['scenario']:<12}{row['target']:<8}{row['images']:>8}{row['failed']:>8}"
+              f"{row['images_per_second']:>8.1f}{latency['p50']:>9.0f}{latency['p95']:>9.0f}{latency['p99']:>9.0f}"
+              f"{row['peak_rss_mb']:>9.0f}")
+    print()
+    print(f"{'scenario':<12}{'target':<8}" + "".join(f"{label:>13}" for label in API_COLUMNS.values())
+          + f"{'429s':>7}{'errors':>8}{'backoffs':>10}")
+    for row in rows:
+        print(f"{row['scenario']:<12}{row['target']:<8}" + "".join(f"{row['api_calls'][api]:>13}" for api in API_COLUMNS)
+              + f"{row['throttled']:>7}{row['errors']:>8}{row['client_backoffs']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
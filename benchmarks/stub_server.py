@@ -0,0 +1,127 @@
+"""Local HTTP stand-in for the Maps endpoints ImageProcessor calls.
+
+Geocoding, Place Details, Places text search and Street View requests are answered
+from recorded responses (benchmarks/recordings/maps.json by default, cycled in order)
+after a configurable delay. A fraction of requests can be answered with server errors
+or rate limiting, the way the real APIs report them: OVER_QUERY_LIMIT in the body for
+Geocoding and Place Details, HTTP 429 for Places and Street View.
+
+    server = StubMapsServer(latency=0.05, rate_limit_rate=0.05).start()
+    processor = ImageProcessor(..., maps_api_url=server.maps_api_url, places_api_url=server.places_api_url)
+    ...
+    server.stop()
+"""
+import asyncio
+import io
+import itertools
+import json
+import random
+import threading
+from collections import Counter
+from pathlib import Path
+
+from aiohttp import web
+from PIL import Image
+
+DEFAULT_RECORDING_PATH = Path(__file__).parent / "recordings" / "maps.json"
+ENDPOINTS = ("geocode", "place_details", "places_text_search", "street_view")
+
+
+def make_street_view_image(size=(600, 300)):
+    output = io.BytesIO()
+    Image.effect_noise(size, 32).convert("RGB").save(output, "JPEG", quality=80)
+    return output.getvalue()
+
+
+class StubMapsServer:
+    def __init__(self, recording_path=DEFAULT_RECORDING_PATH, latency=0.05, jitter=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, seed=0):
+        with open(recording_path) as f:
+            recording = json.load(f)
+        self.responses = {endpoint: itertools.cycle(responses) for endpoint, responses in recording.items()}
+        self.street_view_image = make_street_view_image()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.throttled = Counter()
+        self.loop = None
+        self.thread = None
+        self.runner = None
+        self.base_url = None
+
+    @property
+    def maps_api_url(self):
+        return f"{self.base_url}/maps/api"
+
+    @property
+    def places_api_url(self):
+        return f"{self.base_url}/v1"
+
+    def start(self):
+        # The server gets its own loop and thread, so it keeps answering while the caller blocks or runs its own loop
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="stub-maps-server", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start_site(), self.loop).result()
+        return self
+
+    async def start_site(self):
+        app = web.Application()
+        app.router.add_get("/maps/api/geocode/json", self.json_handler("geocode", status_in_body=True))
+        app.router.add_get("/maps/api/place/details/json", self.json_handler("place_details", status_in_body=True))
+        app.router.add_post("/v1/places:searchText", self.json_handler("places_text_search"))
+        app.router.add_get("/maps/api/streetview", self.street_view)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def delay(self, endpoint):
+        self.calls[endpoint] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.throttled[endpoint] += 1
+            return "throttled"
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors[endpoint] += 1
+            return "error"
+        return None
+
+    def json_handler(self, endpoint, status_in_body=False):
+        async def handle(request):
+            outcome = await self.delay(endpoint)
+            if outcome == "throttled" and status_in_body:
+                return web.json_response({"status": "OVER_QUERY_LIMIT", "results": []})
+            if outcome == "throttled":
+                return web.json_response({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}, status=429)
+            if outcome == "error":
+                return web.json_response({"error": {"code": 500, "status": "INTERNAL"}}, status=500)
+            return web.json_response(next(self.responses[endpoint]))
+        return handle
+
+    async def street_view(self, request):
+        outcome = await self.delay("street_view")
+        if outcome == "throttled":
+            return web.Response(status=429)
+        if outcome == "error":
+            return web.Response(status=500)
+        return web.Response(body=self.street_view_image, content_type="image/jpeg")
+
+    def summary(self):
+        return {
+            endpoint: {"calls": self.calls[endpoint], "errors": self.errors[endpoint],
+                       "throttled": self.throttled[endpoint]}
+            for endpoint in ENDPOINTS
+        }
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import random
+import time
+from pathlib import Path
+
+from PIL import Image
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
+from google.cloud.vision_v1 import types
+
+from scheduler import DEFAULT_API_LIMITS
+
+# Lifts the production quotas so benchmarks measure the pipeline rather than the rate limiter
+UNLIMITED_API_LIMITS = {name: {"concurrency": 1000, "rate": 100000} for name in DEFAULT_API_LIMITS}
+
+
+def make_sample_images(directory, count, size=(1024, 768), with_gps_every=2):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(0)
+    paths = []
+    for i in range(count):
+        img = Image.effect_noise(size, 64).convert("RGB")
+        exif = Image.Exif()
+        if with_gps_every and i % with_gps_every == 0:
+            exif[0x8825] = {
+                1: "N", 2: (48.0, 51.0, 30.0 + rng.random()),
+                3: "E", 4: (2.0, 17.0, 40.0 + rng.random()),
+            }
+        path = directory / f"sample_{i:05d}.jpg"
+        img.save(path, "JPEG", quality=90, exif=exif)
+        paths.append(path)
+    return paths
+
+
+# Response fields filled in by each Vision feature
+FEATURE_FIELDS = {
+    types.Feature.Type.LANDMARK_DETECTION: ["landmark_annotations"],
+    types.Feature.Type.LABEL_DETECTION: ["label_annotations"],
+    types.Feature.Type.WEB_DETECTION: ["web_detection"],
+    types.Feature.Type.IMAGE_PROPERTIES: ["image_properties_annotation"],
+    types.Feature.Type.SAFE_SEARCH_DETECTION: ["safe_search_annotation"],
+    types.Feature.Type.DOCUMENT_TEXT_DETECTION: ["full_text_annotation", "text_annotations"],
+    types.Feature.Type.OBJECT_LOCALIZATION: ["localized_object_annotations"],
+}
+
+SIGN_TEXT = "Champ de Mars 5 Avenue Anatole France 75007 Paris Tour Eiffel Entrée Ticket Office Open 9:00 23:45"
+
+
+def make_full_text_annotation(text, repeat=1):
+    return make_document_text_annotation([" ".join(text.split() * repeat)])
+
+
+def make_document_text_annotation(paragraphs):
+    # One block per paragraph, laid out line by line like a page of text
+    annotation = types.TextAnnotation()
+    page = types.Page()
+    for line, paragraph_text in enumerate(paragraphs):
+        block = types.Block()
+        paragraph = types.Paragraph()
+        x = 0
+        y = line * 16
+        for word_text in paragraph_text.split():
+            word = types.Word()
+            for vertex_x, vertex_y in ((x, y), (x + 10, y), (x + 10, y + 12), (x, y + 12)):
+                word.bounding_box.vertices.append(types.Vertex(x=vertex_x, y=vertex_y))
+            for char in word_text:
+                word.symbols.append(types.Symbol(text=char))
+            paragraph.words.append(word)
+            x += 12
+        block.paragraphs.append(paragraph)
+        page.blocks.append(block)
+    annotation.pages.append(page)
+    annotation.text = "\n".join(paragraphs)
+    return annotation
+
+
+def load_vision_recording(path):
+    # A JSON list of AnnotateImageResponse objects, as produced by AnnotateImageResponse.to_json
+    with open(path) as f:
+        return [types.AnnotateImageResponse.from_json(json.dumps(response)) for response in json.load(f)]
+
+
+def make_annotate_response(index=0, feature_types=None, text_repeat=1):
+    response = types.AnnotateImageResponse()
+    response.label_annotations.append(types.EntityAnnotation(description="Tower", score=0.9))
+    response.label_annotations.append(types.EntityAnnotation(description="Landmark", score=0.85))
+    response.web_detection.web_entities.append(types.WebDetection.WebEntity(description="Eiffel Tower", score=0.8))
+    landmark = types.EntityAnnotation(description="Eiffel Tower", score=0.8)
+    location = types.LocationInfo()
+    location.lat_lng.latitude = 48.8584
+    location.lat_lng.longitude = 2.2945 + index * 1e-5
+    landmark.locations.append(location)
+    response.landmark_annotations.append(landmark)
+    for red in (40, 120, 200):
+        response.image_properties_annotation.dominant_colors.colors.append(
+            types.ColorInfo(color={"red": red, "green": 90, "blue": 160}, score=0.3, pixel_fraction=0.2))
+    response.safe_search_annotation.adult = types.Likelihood.VERY_UNLIKELY
+    response.full_text_annotation = make_full_text_annotation(SIGN_TEXT, text_repeat)
+    response.text_annotations.append(types.EntityAnnotation(description=response.full_text_annotation.text))
+    response.localized_object_annotations.append(types.LocalizedObjectAnnotation(name="Tower", score=0.7))
+    if feature_types is not None:
+        requested = {field for feature in feature_types for field in FEATURE_FIELDS[feature]}
+        for fields in FEATURE_FIELDS.values():
+            for field in fields:
+                if field not in requested:
+                    delattr(response, field)
+    return response
+
+
+class StubVisionClient:
+    """Stands in for ImageAnnotatorAsyncClient with a fixed per-request latency.
+
+    With blocking=True the latency is spent in time.sleep, which is how the
+    synchronous ImageAnnotatorClient behaved when called from the event loop.
+    error_rate and rate_limit_rate are the fractions of requests that fail with
+    UNAVAILABLE and RESOURCE_EXHAUSTED. Responses are synthesized unless a list of
+    recorded ones is given; without_landmark_every drops the landmark from every
+    n-th synthesized response so the Places text search fallback runs too.
+    """
+
+    def __init__(self, latency=0.2, blocking=False, latency_per_feature=0.0, upload_bytes_per_second=None,
+                 jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, responses=None, without_landmark_every=0, seed=0):
+        self.latency = latency
+        self.latency_per_feature = latency_per_feature
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.blocking = blocking
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.responses = responses
+        self.without_landmark_every = without_landmark_every
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.images = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def make_response(self, index, request):
+        if self.responses:
+            return self.responses[index % len(self.responses)]
+        response = make_annotate_response(index, [feature.type_ for feature in request.features])
+        if self.without_landmark_every and index % self.without_landmark_every == 0:
+            del response.landmark_annotations
+        return response
+
+    async def batch_annotate_images(self, requests):
+        self.requests += 1
+        request_bytes = sum(len(request.image.content) for request in requests)
+        self.bytes_sent += request_bytes
+        latency = self.latency + self.latency_per_feature * max(len(request.features) for request in requests)
+        if self.jitter:
+            latency = max(0.0, latency + self.rng.uniform(-self.jitter, self.jitter))
+        if self.upload_bytes_per_second:
+            latency += request_bytes / self.upload_bytes_per_second
+        if self.blocking:
+            time.sleep(latency)
+        else:
+            await asyncio.sleep(latency)
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.throttled += 1
+            raise ResourceExhausted("Quota exceeded (stub)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors += 1
+            raise ServiceUnavailable("Service unavailable (stub)")
+        self.images += len(requests)
+        return types.BatchAnnotateImagesResponse(responses=[
+            self.make_response(self.images + i, request) for i, request in enumerate(requests)
+        ])
+
+
+class _StubResponse:
+    def __init__(self, url, latency):
+        self.url = url
+        self.latency = latency
+        self.status = 200
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.latency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def json(self):
+        if "geocode" in self.url:
+            return {"status": "OK", "results": [{"formatted_address": "Champ de Mars, Paris", "types": ["tourist_attraction"], "place_id": "stub-place"}]}
+        if "details" in self.url:
+            return {"status": "OK", "result": {"name": "Eiffel Tower", "rating": 4.7}}
+        return {"places": [{"location": {"latitude": 48.8584, "longitude": 2.2945}, "displayName": {"text": "Eiffel Tower"}, "formattedAddress": "Champ de Mars, Paris"}]}
+
+    async def read(self):
+        return b"\xff\xd8stub-street-view\xff\xd9"
+
+
+class StubSession:
+    """Minimal aiohttp.ClientSession replacement answering every Maps call with canned data."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return _StubResponse(url, self.latency)
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        return _StubResponse(url, self.latency)
+
+    async def close(self):
+        pass
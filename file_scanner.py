@@ -0,0 +1,176 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+
+from grouped_commits import DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL, GroupedCommits
+
+try:
+    from pillow_heif import register_heif_opener
+except ImportError:
+    register_heif_opener = None
+else:
+    register_heif_opener()
+
+logger = logging.getLogger("photolocationfinder.file_scanner")
+
+DEFAULT_SCAN_MANIFEST_PATH = 'scan_manifest.sqlite3'
+
+IMAGE_TYPE_EXTENSIONS = {
+    "jpeg": (".jpg", ".jpeg"),
+    "png": (".png",),
+    "webp": (".webp",),
+    "heif": (".heic", ".heif"),
+}
+# JPEG and PNG are always read; the others only when the installed Pillow can decode them
+OPTIONAL_IMAGE_TYPES = ("webp", "heif")
+# The Vision API doesn't accept these, so they are converted to JPEG before upload
+CONVERTED_EXTENSIONS = (".heic", ".heif")
+HEIF_BRANDS = (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1")
+# Thumbnail and recycle bin folders that NAS devices create next to the photos
+SKIPPED_DIRECTORIES = ("@eaDir", "#recycle", "$RECYCLE.BIN")
+
+
+def supported_image_types():
+    Image.init()
+    registered = Image.registered_extensions()
+    types = {"jpeg", "png"}
+    for image_type in OPTIONAL_IMAGE_TYPES:
+        if all(extension in registered for extension in IMAGE_TYPE_EXTENSIONS[image_type]):
+            types.add(image_type)
+    return types
+
+
+def sniff_image_type(path):
+    # The extension only says what a file claims to be; the first bytes say what it is
+    with open(path, 'rb') as f:
+        header = f.read(16)
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS:
+        return "heif"
+    return None
+
+
+class ScanManifest:
+    # Files are recorded per fingerprint of the settings that shape their results (see
+    # ImageProcessor.manifest_fingerprint), so a run with another output or profile starts afresh
+    def __init__(self, path=DEFAULT_SCAN_MANIFEST_PATH, fingerprint="", commit_every=DEFAULT_COMMIT_EVERY,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.scanned = {}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.commits = GroupedCommits(self.conn, commit_every, commit_interval)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(scanned_files)")]
+        if columns and "fingerprint" not in columns:
+            # Written before fingerprints; without one its entries can't be trusted
+            self.conn.execute("DROP TABLE scanned_files")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scanned_files (
+                fingerprint TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (fingerprint, path)
+            )
+        """)
+        self.conn.commit()
+
+    def is_unchanged(self, path, size, mtime_ns):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns FROM scanned_files WHERE fingerprint = ? AND path = ?",
+                (self.fingerprint, os.path.abspath(path))
+            ).fetchone()
+        return row == (size, mtime_ns)
+
+    def add_scanned(self, path, size, mtime_ns):
+        with self.lock:
+            self.scanned[path] = (size, mtime_ns)
+
+    def mark_processed(self, path):
+        # Only files that were processed successfully are recorded, so failures are retried on the next run
+        with self.lock:
+            stat = self.scanned.pop(path, None)
+            if stat is None:
+                return
+            self.conn.execute(
+                "INSERT OR REPLACE INTO scanned_files (fingerprint, path, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                (self.fingerprint, os.path.abspath(path), *stat)
+            )
+            self.commits.changed()
+
+    def close(self):
+        with self.lock:
+            self.commits.commit()
+            self.conn.close()
+
+
+class FileScanner:
+    def __init__(self, manifest=None):
+        self.manifest = manifest
+        self.image_types = supported_image_types()
+        self.extensions = tuple(
+            extension for image_type in self.image_types for extension in IMAGE_TYPE_EXTENSIONS[image_type]
+        )
+        self.found = 0
+        self.unchanged = 0
+        self.rejected = 0
+
+    def scan_directory(self, directory, incremental=True):
+        # Lists one directory; the caller walks the tree so that images are handed out while the scan goes on
+        files = []
+        subdirectories = []
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.error("Error scanning directory %s: %s", directory, e)
+            return files, subdirectories
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.') and entry.name not in SKIPPED_DIRECTORIES:
+                        subdirectories.append(entry.path)
+                    continue
+                if not entry.name.lower().endswith(self.extensions) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if incremental and self.manifest and self.manifest.is_unchanged(entry.path, stat.st_size,
+                                                                                 stat.st_mtime_ns):
+                    self.unchanged += 1
+                    continue
+                if sniff_image_type(entry.path) not in self.image_types:
+                    logger.info("Skipping %s: not a supported image file", entry.path)
+                    self.rejected += 1
+                    continue
+            except OSError as e:
+                logger.error("Error scanning %s: %s", entry.path, e)
+                continue
+            if self.manifest:
+                self.manifest.add_scanned(entry.path, stat.st_size, stat.st_mtime_ns)
+            self.found += 1
+            files.append(entry.path)
+        return files, subdirectories
+
+    def scan(self, root, incremental=True):
+        directories = [os.path.normpath(root)]
+        while directories:
+            files, subdirectories = self.scan_directory(directories.pop(), incremental)
+            # Reversed so that the stack visits subdirectories in name order
+            directories.extend(reversed(subdirectories))
+            yield from files
+
+    def summary(self):
+        return (f"Scan: {self.found} images queued, {self.unchanged} unchanged since the last run, "
+                f"{self.rejected} skipped as not an image")
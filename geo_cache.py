@@ -0,0 +1,167 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+from grouped_commits import DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL, GroupedCommits
+
+DEFAULT_GEO_CACHE_TTL = 30 * 24 * 3600
+DEFAULT_GEO_CACHE_MAX_ENTRIES = 5000
+# Precision 8 geohash cells are roughly 38m x 19m
+DEFAULT_GEOHASH_PRECISION = 8
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Stands in for a value that is still on disk; it is read the first time the entry is used
+NOT_LOADED = object()
+
+
+def encode_geohash(lat, lng, precision=DEFAULT_GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        value_range, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+
+class GeoCache:
+    def __init__(self, path=None, ttl=DEFAULT_GEO_CACHE_TTL, max_entries=DEFAULT_GEO_CACHE_MAX_ENTRIES,
+                 precision=DEFAULT_GEOHASH_PRECISION, commit_every=DEFAULT_COMMIT_EVERY,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.stats = {}
+        self.conn = None
+        self.commits = None
+        if path:
+            self.conn = sqlite3.connect(path)
+            self.commits = GroupedCommits(self.conn, commit_every, commit_interval)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS geo_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self.conn.execute("DELETE FROM geo_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self.conn.commit()
+            # Only the keys are loaded up front: values can be whole Street View images
+            rows = self.conn.execute(
+                "SELECT namespace, key, created_at FROM geo_cache ORDER BY created_at DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            for namespace, key, created_at in reversed(rows):
+                self.entries[(namespace, key)] = (NOT_LOADED, created_at)
+
+    def cell(self, lat, lng):
+        return encode_geohash(lat, lng, self.precision)
+
+    def count(self, namespace, outcome):
+        counts = self.stats.setdefault(namespace, {"hits": 0, "misses": 0, "deduplicated": 0})
+        counts[outcome] += 1
+
+    def get(self, namespace, key):
+        entry = self.entries.get((namespace, key))
+        if entry is None:
+            return None
+        value, created_at = entry
+        if time.time() - created_at > self.ttl:
+            self.delete(namespace, key)
+            return None
+        if value is NOT_LOADED:
+            row = self.conn.execute(
+                "SELECT value FROM geo_cache WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            if row is None:
+                del self.entries[(namespace, key)]
+                return None
+            value = json.loads(row[0])
+            self.entries[(namespace, key)] = (value, created_at)
+        self.entries.move_to_end((namespace, key))
+        return value
+
+    def put(self, namespace, key, value):
+        created_at = time.time()
+        self.entries[(namespace, key)] = (value, created_at)
+        self.entries.move_to_end((namespace, key))
+        if self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geo_cache (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), created_at)
+            )
+        while len(self.entries) > self.max_entries:
+            (old_namespace, old_key), _ = self.entries.popitem(last=False)
+            if self.conn:
+                self.conn.execute("DELETE FROM geo_cache WHERE namespace = ? AND key = ?", (old_namespace, old_key))
+        self.changed()
+
+    def delete(self, namespace, key):
+        self.entries.pop((namespace, key), None)
+        if self.conn:
+            self.conn.execute("DELETE FROM geo_cache WHERE namespace = ? AND key = ?", (namespace, key))
+        self.changed()
+
+    def changed(self):
+        # This runs on the event loop, so commits are grouped rather than synced to disk per lookup
+        if self.commits:
+            self.commits.changed()
+
+    async def get_or_fetch(self, namespace, key, fetch):
+        value = self.get(namespace, key)
+        if value is not None:
+            self.count(namespace, "hits")
+            return value
+
+        # Concurrent lookups for the same cell share one request instead of each calling the API
+        task = self.in_flight.get((namespace, key))
+        if task is None:
+            self.count(namespace, "misses")
+            task = asyncio.ensure_future(self.fetch_and_store(namespace, key, fetch))
+            self.in_flight[(namespace, key)] = task
+            task.add_done_callback(lambda _: self.in_flight.pop((namespace, key), None))
+        else:
+            self.count(namespace, "deduplicated")
+        return await asyncio.shield(task)
+
+    async def fetch_and_store(self, namespace, key, fetch):
+        value = await fetch()
+        # Empty answers are not cached; they are often transient failures
+        if value is not None:
+            self.put(namespace, key, value)
+        return value
+
+    def summary(self):
+        parts = [
+            f"{namespace}: {counts['hits']} hits, {counts['misses']} misses, {counts['deduplicated']} deduplicated"
+            for namespace, counts in self.stats.items()
+        ]
+        return "Geo cache: " + ("; ".join(parts) if parts else "unused")
+
+    def close(self):
+        if self.conn:
+            self.commits.commit()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,25 @@
+import time
+
+DEFAULT_COMMIT_EVERY = 50
+DEFAULT_COMMIT_INTERVAL = 2.0
+
+
+class GroupedCommits:
+    # Commits a SQLite connection's writes every commit_every changes or commit_interval seconds,
+    # so a large run doesn't pay for a disk sync per image. Callers serialize access themselves.
+    def __init__(self, conn, commit_every=DEFAULT_COMMIT_EVERY, commit_interval=DEFAULT_COMMIT_INTERVAL):
+        self.conn = conn
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def changed(self):
+        self.pending += 1
+        if self.pending >= self.commit_every or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
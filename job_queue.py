@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+import uuid
+
+DEFAULT_MAX_CONCURRENT_JOBS = 8
+DEFAULT_MAX_FINISHED_JOBS = 1000
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATUSES = (DONE, FAILED)
+
+
+class JobQueue:
+    def __init__(self, processor, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS,
+                 max_finished_jobs=DEFAULT_MAX_FINISHED_JOBS):
+        self.processor = processor
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = {}
+        self.condition = threading.Condition()
+        # One event loop in a background thread owns the processor, its aiohttp session and Vision client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="job-queue", daemon=True)
+        self.thread.start()
+        self.semaphore = self.run(self.create_semaphore())
+
+    async def create_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrent_jobs)
+
+    def run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    def submit(self, image_path, job_id=None, **options):
+        job_id = job_id or self.new_job_id()
+        with self.condition:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": QUEUED,
+                "filename": image_path,
+                "created_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            self.prune()
+        asyncio.run_coroutine_threadsafe(self.run_job(job_id, image_path, options), self.loop)
+        return job_id
+
+    def submit_batch(self, image_paths, result_path, job_id=None, **options):
+        job_id = job_id or self.new_job_id()
+        with self.condition:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": QUEUED,
+                "filename": None,
+                "batch": True,
+                "total": len(image_paths),
+                "completed": 0,
+                "result_path": result_path,
+                "created_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            self.prune()
+        asyncio.run_coroutine_threadsafe(self.run_batch_job(job_id, image_paths, result_path, options), self.loop)
+        return job_id
+
+    async def run_job(self, job_id, image_path, options):
+        async with self.semaphore:
+            self.update(job_id, status=RUNNING)
+            try:
+                await self.processor.initialize()
+                with self.processor.metrics.span("image"):
+                    result = await self.processor.process_image(image_path, **options)
+            except Exception as e:
+                result = {"error": str(e), "filename": image_path}
+            self.processor.metrics.count_image("failed" if "error" in result else "done")
+            if "error" in result:
+                self.update(job_id, status=FAILED, error=result["error"], finished_at=time.time())
+            else:
+                self.update(job_id, status=DONE, result=result, finished_at=time.time())
+
+    async def run_batch_job(self, job_id, image_paths, result_path, options):
+        # A whole batch takes one job slot; the processor spreads its images over its own workers
+        async with self.semaphore:
+            self.update(job_id, status=RUNNING)
+            try:
+                await self.processor.initialize()
+                count = await self.processor.process_image_files(
+                    image_paths, result_path, on_result=lambda result: self.advance(job_id), **options)
+            except Exception as e:
+                self.update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            else:
+                self.update(job_id, status=DONE, result={"count": count}, finished_at=time.time())
+
+    def advance(self, job_id):
+        with self.condition:
+            self.jobs[job_id]["completed"] += 1
+            self.condition.notify_all()
+
+    def update(self, job_id, **fields):
+        with self.condition:
+            self.jobs[job_id].update(fields)
+            self.condition.notify_all()
+
+    def get(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def status_counts(self):
+        with self.condition:
+            counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def wait_for_change(self, job_id, status, timeout, completed=None):
+        # Batch jobs also count as changed when another of their images has finished
+        with self.condition:
+            self.condition.wait_for(
+                lambda: job_id not in self.jobs or self.jobs[job_id]["status"] != status
+                or self.jobs[job_id].get("completed") != completed, timeout)
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def prune(self):
+        # Finished jobs are kept for result pages until there are too many of them
+        finished = sorted(
+            (job for job in self.jobs.values() if job["status"] in FINISHED_STATUSES),
+            key=lambda job: job["finished_at"]
+        )
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job["id"]]
+
+    def shutdown(self):
+        # Safe to call twice, e.g. explicitly and again from atexit
+        if not self.thread.is_alive():
+            return
+        self.run(self.processor.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,132 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+METRIC_PREFIX = "photolocationfinder"
+# Upper bounds in seconds; covers a local file read up to a throttled, retried API call
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+API_COUNTERS = ("calls", "retries", "errors", "throttled")
+LOG_LEVELS = ("debug", "info", "warning", "error", "off")
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        # Interpolated within the bucket the quantile falls in, the same estimate Prometheus uses
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.api = defaultdict(lambda: dict.fromkeys(API_COUNTERS, 0))
+        self.images = defaultdict(int)
+        self.started_at = time.time()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram(self.buckets)
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count_api(self, api, counter, amount=1):
+        with self.lock:
+            self.api[api][counter] += amount
+
+    def count_image(self, status):
+        with self.lock:
+            self.images[status] += 1
+
+    def summary(self):
+        with self.lock:
+            return {
+                "elapsed_seconds": round(time.time() - self.started_at, 3),
+                "images": dict(self.images),
+                "stages": {
+                    stage: {
+                        "count": histogram.count,
+                        "total_seconds": round(histogram.sum, 3),
+                        "mean_ms": round(histogram.sum / histogram.count * 1000, 1) if histogram.count else 0.0,
+                        "p50_ms": round(histogram.quantile(0.5) * 1000, 1),
+                        "p95_ms": round(histogram.quantile(0.95) * 1000, 1),
+                        "p99_ms": round(histogram.quantile(0.99) * 1000, 1),
+                    }
+                    for stage, histogram in self.stages.items()
+                },
+                "api": {api: dict(counters) for api, counters in self.api.items()},
+            }
+
+    def prometheus(self):
+        # Prometheus text exposition format, version 0.0.4
+        lines = []
+        with self.lock:
+            name = f"{METRIC_PREFIX}_stage_duration_seconds"
+            lines += [f"# HELP {name} Time spent in each processing stage and API call.", f"# TYPE {name} histogram"]
+            for stage, histogram in self.stages.items():
+                cumulative = 0
+                for upper, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            for counter in API_COUNTERS:
+                name = f"{METRIC_PREFIX}_api_{counter}_total"
+                lines += [f"# HELP {name} Google API requests: {counter}.", f"# TYPE {name} counter"]
+                lines += [f'{name}{{api="{api}"}} {counters[counter]}' for api, counters in self.api.items()]
+            name = f"{METRIC_PREFIX}_images_total"
+            lines += [f"# HELP {name} Images processed, by outcome.", f"# TYPE {name} counter"]
+            lines += [f'{name}{{status="{status}"}} {count}' for status, count in self.images.items()]
+        return "\n".join(lines) + "\n"
+
+    def stage_table(self):
+        summary = self.summary()
+        lines = [f"{'stage':<20}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for stage, values in summary["stages"].items():
+            lines.append(f"{stage:<20}{values['count']:>8}{values['total_seconds']:>10.2f}{values['p50_ms']:>10.1f}"
+                         f"{values['p95_ms']:>10.1f}{values['p99_ms']:>10.1f}")
+        return "\n".join(lines)
+
+
+def configure_logging(level="info"):
+    # Called again when the web app is imported into a process that already set it up (the replay
+    # benchmark does both): the root handlers are replaced rather than added to, and the new level applies
+    if level == "off":
+        logging.disable(logging.CRITICAL)
+        return
+    logging.disable(logging.NOTSET)
+    logging.basicConfig(level=getattr(logging, level.upper()),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s", force=True)
@@ -0,0 +1,110 @@
+import re
+import textwrap
+
+# "compact" keeps the OCR text as one string with a flat list of word boxes, "words" keeps the
+# original list with a dict per word, "none" leaves OCR text out of the result
+OCR_FORMATS = ("compact", "words", "none")
+DEFAULT_OCR_FORMAT = "compact"
+DEFAULT_LOCATION_TEXT_MAX_CHARS = 150
+# Corners per word box, each stored as x, y
+BOX_VERTICES = 4
+
+STREET_WORDS = {
+    "street", "st", "avenue", "ave", "road", "rd", "boulevard", "blvd", "lane", "ln", "drive", "dr", "way",
+    "square", "sq", "plaza", "place", "pl", "highway", "hwy", "court", "ct", "terrace", "row", "quay", "embankment",
+    "rue", "bd", "chemin", "quai", "allée", "impasse", "via", "viale", "piazza", "corso", "largo",
+    "calle", "avenida", "paseo", "carrer", "rua", "praça", "straße", "strasse", "str", "weg", "gasse",
+    "platz", "allee", "ufer", "damm", "laan", "straat", "gracht", "plein", "ulica", "náměstí", "utca",
+}
+PLACE_WORDS = {
+    "station", "museum", "church", "cathedral", "chapel", "park", "garden", "gardens", "tower", "bridge", "castle",
+    "palace", "temple", "shrine", "mosque", "synagogue", "market", "harbour", "harbor", "port", "airport", "terminal",
+    "university", "college", "library", "theatre", "theater", "stadium", "hotel", "hall", "monument", "memorial",
+    "beach", "lake", "mount", "mountain", "island", "gallery", "zoo", "abbey", "fort", "gate", "center", "centre",
+    "gare", "musée", "église", "château", "jardin", "pont", "bahnhof", "hauptbahnhof", "kirche", "dom", "schloss",
+    "brücke", "rathaus", "stazione", "chiesa", "duomo", "ponte", "museo", "estación", "iglesia", "catedral",
+}
+POSTAL_CODE = re.compile(r"\b(\d{5}(-\d{4})?|\d{3}-\d{4}|\d{4} ?[A-Z]{2}|[A-Z]{1,2}\d[A-Z\d]? ?\d[A-Z]{2})\b")
+HOUSE_NUMBER = re.compile(r"\b\d{1,4}[a-zA-Z]?\b")
+# Opening hours, prices, phone numbers and web addresses are common on signs and never help a place search
+NOISE = re.compile(r"\d{1,2}[:.]\d{2}\b|[$€£¥]\s?\d|\d\s?[$€£¥]|\+?\d[\d ()./-]{7,}\d|www\.|https?://|\S+@\S+|\.(com|org|net)\b",
+                   re.IGNORECASE)
+
+
+def extract_ocr_text(response, with_boxes=True):
+    # Walks the raw protobuf message: on documents and busy signs the proto-plus wrappers cost
+    # more than the extraction itself. Words are separated by spaces and paragraphs by newlines.
+    annotation = type(response).pb(response).full_text_annotation
+    paragraphs = []
+    boxes = [] if with_boxes else None
+    for page in annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                words = []
+                for word in paragraph.words:
+                    word_text = ''.join([symbol.text for symbol in word.symbols])
+                    if not word_text:
+                        continue
+                    words.append(word_text)
+                    if with_boxes:
+                        vertices = word.bounding_box.vertices
+                        for index in range(BOX_VERTICES):
+                            if index < len(vertices):
+                                boxes += (vertices[index].x, vertices[index].y)
+                            else:
+                                boxes += (0, 0)
+                paragraphs.append(" ".join(words))
+    return "\n".join(paragraphs), boxes
+
+
+def score_phrase(phrase):
+    words = phrase.split()
+    lowered = {word.strip(".,;:()").lower() for word in words}
+    alphabetic = [word for word in words if word[0].isalpha()]
+    if not alphabetic:
+        return 0
+    score = 0
+    if lowered & STREET_WORDS:
+        score += 3
+    if lowered & PLACE_WORDS:
+        score += 2
+    if POSTAL_CODE.search(phrase):
+        score += 2
+    # A house number only counts next to a street or place name
+    if score and HOUSE_NUMBER.search(phrase):
+        score += 1
+    if sum(word[0].isupper() for word in alphabetic) * 2 >= len(alphabetic):
+        score += 1
+    return score - 2 * len(NOISE.findall(phrase))
+
+
+def select_location_text(text, max_chars=DEFAULT_LOCATION_TEXT_MAX_CHARS):
+    # Best-scoring phrases first, as many as fit in max_chars. Without any address- or place-like
+    # phrase the text is used in reading order, which is what the whole text used to be sent as.
+    phrases = []
+    seen = set()
+    for paragraph in text.split("\n"):
+        for phrase in textwrap.wrap(paragraph, max_chars, break_long_words=False, break_on_hyphens=False):
+            # Signs often repeat the same line, and each repetition would only use up the budget
+            if len(phrase) < 3 or phrase.lower() in seen:
+                continue
+            seen.add(phrase.lower())
+            phrases.append((score_phrase(phrase), len(phrases), phrase))
+    ranked = sorted((phrase for phrase in phrases if phrase[0] > 0), key=lambda phrase: (-phrase[0], phrase[1]))
+    selected = []
+    length = 0
+    for _, _, phrase in ranked or phrases:
+        if length + len(phrase) > max_chars:
+            continue
+        selected.append(phrase)
+        length += len(phrase) + 2
+    return ", ".join(selected)
+
+
+def words_with_boxes(text, boxes):
+    # Expands the compact form into the "words" format, one dict per word
+    step = BOX_VERTICES * 2
+    return [
+        {"text": word, "coords": list(zip(boxes[i * step:(i + 1) * step:2], boxes[i * step + 1:(i + 1) * step:2]))}
+        for i, word in enumerate(text.split())
+    ]
@@ -1,11 +1,20 @@
+import argparse
 import asyncio
 import os
 import json
 from pathlib import Path
-import time
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
+from PIL import Image, ImageOps
+from PIL.ExifTags import GPSTAGS
 import base64
+import hashlib
+import tempfile
+import time
+import io
+import logging
+import multiprocessing
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import aiohttp
 from google.cloud import vision
@@ -13,12 +22,188 @@ from google.cloud.vision_v1 import types
 from tenacity import retry, stop_after_attempt, wait_exponential
 from urllib.parse import quote
 
+from file_scanner import CONVERTED_EXTENSIONS, DEFAULT_SCAN_MANIFEST_PATH, FileScanner, ScanManifest
+from geo_cache import DEFAULT_GEO_CACHE_MAX_ENTRIES, DEFAULT_GEO_CACHE_TTL, DEFAULT_GEOHASH_PRECISION, GeoCache, encode_geohash
+from metrics import LOG_LEVELS, Metrics, configure_logging
+from ocr_text import (DEFAULT_LOCATION_TEXT_MAX_CHARS, DEFAULT_OCR_FORMAT, OCR_FORMATS, extract_ocr_text,
+                      select_location_text, words_with_boxes)
+from result_store import DEFAULT_RESULT_STORE_PATH, ResultStore
+from result_writer import ResultWriter, load_completed_filenames
+from scheduler import RateLimitedError, Scheduler
+from vision_cache import DEFAULT_VISION_CACHE_MAX_BYTES, VisionCache
+from work_queue import (ADD_BATCH_SIZE, DEFAULT_CLAIM_SIZE, DEFAULT_POLL_INTERVAL, DEFAULT_WORK_QUEUE_PATH, WorkQueue,
+                        worker_name)
+
+logger = logging.getLogger("photolocationfinder")
+
+# Vision API limits for a single images:annotate call
+MAX_VISION_BATCH_SIZE = 16
+DEFAULT_VISION_BATCH_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_IO_WORKERS = 8
+DEFAULT_MAX_CONCURRENT_IMAGES = 32
+DEFAULT_PROGRESS_INTERVAL = 10
+DEFAULT_RESULT_PATH = 'result.jsonl'
+DEFAULT_METRICS_PATH = 'metrics.json'
+# "inline" embeds base64 imagery in each result, "file" saves it once per location and size,
+# "lazy" only records the location so the image is fetched when it is displayed
+STREET_VIEW_MODES = ("inline", "file", "lazy")
+STREET_VIEW_SIZE = '600x300'
+# Overridable so the Maps calls can go through a proxy or the local stub server in benchmarks/
+DEFAULT_MAPS_API_URL = 'https://maps.googleapis.com/maps/api'
+DEFAULT_PLACES_API_URL = 'https://places.googleapis.com/v1'
+
+FULL_VISION_FEATURES = [
+    types.Feature.Type.LANDMARK_DETECTION,
+    types.Feature.Type.LABEL_DETECTION,
+    types.Feature.Type.WEB_DETECTION,
+    types.Feature.Type.IMAGE_PROPERTIES,
+    types.Feature.Type.SAFE_SEARCH_DETECTION,
+    types.Feature.Type.DOCUMENT_TEXT_DETECTION,
+    types.Feature.Type.OBJECT_LOCALIZATION
+]
+# EXIF coordinates already answer "where", so only ask Vision what is in the photo
+GPS_VISION_FEATURES = [
+    types.Feature.Type.LANDMARK_DETECTION,
+    types.Feature.Type.LABEL_DETECTION
+]
+VISION_FEATURE_PROFILES = {
+    "full": FULL_VISION_FEATURES,
+    # Everything the location fallback chain reads: landmarks, OCR text, labels and web entities
+    "location-minimal": [
+        types.Feature.Type.LANDMARK_DETECTION,
+        types.Feature.Type.LABEL_DETECTION,
+        types.Feature.Type.WEB_DETECTION,
+        types.Feature.Type.DOCUMENT_TEXT_DETECTION
+    ],
+    "landmark-only": [
+        types.Feature.Type.LANDMARK_DETECTION
+    ]
+}
+DEFAULT_FEATURE_PROFILE = "full"
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_STRATEGY_HEDGE_DELAY = 0.5
+EXIF_ORIENTATION_TAG = 0x0112
+# Formats that are uploaded as they are when no resizing is needed; anything else is re-encoded as JPEG
+VISION_NATIVE_FORMATS = ("JPEG", "PNG", "WEBP")
+# Maps each retried method to the API its retries are counted against
+RETRIED_APIS = {
+    "annotate_image": "vision",
+    "annotate_batch": "vision",
+    "get_location_from_google_maps_api": "places_text_search",
+    "_reverse_geocode": "geocoding",
+    "_get_place_details": "place_details",
+    "fetch_street_view_image": "street_view",
+}
+# "full" always runs every feature, "reduced" uses GPS_VISION_FEATURES and "skip" bypasses Vision
+# for images that carry GPS coordinates
+GPS_MODES = ("full", "reduced", "skip")
+GPS_IFD_TAG = 0x8825
+DEFAULT_STREET_VIEW_DIR = 'street_view'
+
+
+def read_image_for_vision(image_path, max_edge, quality):
+    # Runs in a worker process: returns the bytes to upload and the hash of the original file
+    with open(image_path, 'rb') as image_file:
+        content = image_file.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    with Image.open(io.BytesIO(content)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        fits = not max_edge or max(img.size) <= max_edge
+        if fits and orientation == 1 and img.format in VISION_NATIVE_FORMATS:
+            return content, content_hash
+        # Re-encoding drops EXIF, so the orientation is applied to the pixels first
+        img = ImageOps.exif_transpose(img)
+        if not fits:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue(), content_hash
+
+
+def record_retry(retry_state):
+    # tenacity calls this before sleeping between attempts; args[0] is the ImageProcessor
+    api = RETRIED_APIS.get(retry_state.fn.__name__)
+    if api:
+        retry_state.args[0].metrics.count_api(api, "retries")
+    logger.warning("Retrying %s after attempt %d failed: %s", retry_state.fn.__name__,
+                   retry_state.attempt_number, retry_state.outcome.exception())
+
+
+async def as_async_iterator(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
 class ImageProcessor:
-    def __init__(self, api_key, cred_path, image_dir, prompt_for_confirmation):
+    def __init__(self, api_key, cred_path, image_dir, prompt_for_confirmation,
+                 batch_size=1, batch_max_bytes=DEFAULT_VISION_BATCH_MAX_BYTES,
+                 io_workers=DEFAULT_IO_WORKERS, max_concurrent_images=DEFAULT_MAX_CONCURRENT_IMAGES,
+                 api_limits=None, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 vision_cache_path=None, vision_cache_max_bytes=DEFAULT_VISION_CACHE_MAX_BYTES,
+                 geo_cache_path=None, geo_cache_ttl=DEFAULT_GEO_CACHE_TTL,
+                 geo_cache_max_entries=DEFAULT_GEO_CACHE_MAX_ENTRIES, geo_cache_precision=DEFAULT_GEOHASH_PRECISION,
+                 result_path=DEFAULT_RESULT_PATH, result_store_path=DEFAULT_RESULT_STORE_PATH,
+                 street_view_mode="inline", street_view_dir=DEFAULT_STREET_VIEW_DIR, gps_mode="full",
+                 feature_profile=DEFAULT_FEATURE_PROFILE, max_image_edge=None, jpeg_quality=DEFAULT_JPEG_QUALITY,
+                 preprocess_workers=None, strategy_hedge_delay=DEFAULT_STRATEGY_HEDGE_DELAY, scan_manifest_path=None,
+                 maps_api_url=DEFAULT_MAPS_API_URL, places_api_url=DEFAULT_PLACES_API_URL, metrics_path=None,
+                 ocr_format=DEFAULT_OCR_FORMAT, location_text_max_chars=DEFAULT_LOCATION_TEXT_MAX_CHARS):
         self.api_key = api_key
         self.cred_path = cred_path
         self.image_dir = image_dir
         self.prompt_for_confirmation = prompt_for_confirmation
+        self.batch_size = max(1, min(batch_size, MAX_VISION_BATCH_SIZE))
+        self.batch_max_bytes = batch_max_bytes
+        self.io_workers = io_workers
+        self.executor = None
+        self.max_concurrent_images = max_concurrent_images
+        self.api_limits = api_limits
+        self.progress_interval = progress_interval
+        self.scheduler = None
+        self.vision_cache_path = vision_cache_path
+        self.vision_cache_max_bytes = vision_cache_max_bytes
+        self.vision_cache = None
+        self.geo_cache_path = geo_cache_path
+        self.geo_cache_ttl = geo_cache_ttl
+        self.geo_cache_max_entries = geo_cache_max_entries
+        self.geo_cache_precision = geo_cache_precision
+        self.geo_cache = None
+        self.result_path = result_path
+        self.result_store_path = result_store_path
+        self.result_store = None
+        if street_view_mode not in STREET_VIEW_MODES:
+            raise ValueError(f"Unknown street_view_mode '{street_view_mode}', expected one of {STREET_VIEW_MODES}")
+        self.street_view_mode = street_view_mode
+        self.street_view_dir = street_view_dir
+        if gps_mode not in GPS_MODES:
+            raise ValueError(f"Unknown gps_mode '{gps_mode}', expected one of {GPS_MODES}")
+        self.gps_mode = gps_mode
+        if feature_profile not in VISION_FEATURE_PROFILES:
+            raise ValueError(f"Unknown feature_profile '{feature_profile}', expected one of {tuple(VISION_FEATURE_PROFILES)}")
+        self.feature_profile = feature_profile
+        self.vision_features = VISION_FEATURE_PROFILES[feature_profile]
+        self.max_image_edge = max_image_edge
+        self.jpeg_quality = jpeg_quality
+        self.preprocess_workers = preprocess_workers
+        self.process_pool = None
+        self.strategy_hedge_delay = strategy_hedge_delay
+        self.scan_manifest_path = scan_manifest_path
+        self.scan_manifest = None
+        self.maps_api_url = maps_api_url.rstrip('/')
+        self.places_api_url = places_api_url.rstrip('/')
+        # Shared by every run of a long-lived processor, so the web app reports totals since it started
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+        if ocr_format not in OCR_FORMATS:
+            raise ValueError(f"Unknown ocr_format '{ocr_format}', expected one of {OCR_FORMATS}")
+        self.ocr_format = ocr_format
+        self.location_text_max_chars = location_text_max_chars
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = self.cred_path
         self.client = None
         self.session = None
@@ -26,144 +211,314 @@ class ImageProcessor:
 
     async def initialize(self):
         if self.client is None:
-            self.client = vision.ImageAnnotatorClient()
+            self.client = vision.ImageAnnotatorAsyncClient()
+        if self.executor is None:
+            # Disk reads and Pillow EXIF decoding run here so they don't stall the event loop
+            self.executor = ThreadPoolExecutor(max_workers=self.io_workers)
+        if self.process_pool is None and self.max_image_edge:
+            # Resizing is CPU-bound Pillow work, so it gets its own processes rather than threads
+            # "spawn" avoids forking a process that already has gRPC threads running
+            self.process_pool = ProcessPoolExecutor(max_workers=self.preprocess_workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+        if self.scheduler is None:
+            self.scheduler = Scheduler(self.api_limits, self.progress_interval, self.metrics)
+        if self.vision_cache is None and self.vision_cache_path:
+            self.vision_cache = VisionCache(self.vision_cache_path, self.vision_cache_max_bytes)
+        if self.geo_cache is None:
+            self.geo_cache = GeoCache(self.geo_cache_path, self.geo_cache_ttl,
+                                      self.geo_cache_max_entries, self.geo_cache_precision)
+        if self.result_store is None and self.result_store_path:
+            self.result_store = ResultStore(self.result_store_path)
+        if self.scan_manifest is None and self.scan_manifest_path:
+            self.scan_manifest = ScanManifest(self.scan_manifest_path, self.manifest_fingerprint())
         if self.session is None:
             self.session = aiohttp.ClientSession()
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    async def process_image(self, image_path: str):
+    def build_annotate_request(self, content, feature_types=None):
+        image = vision.Image(content=content)
+        features = [types.Feature(type=feature_type) for feature_type in feature_types or self.vision_features]
+        return types.AnnotateImageRequest(image=image, features=features)
+
+    def build_request_for_image(self, content, gps_info, feature_types=None):
+        feature_types = feature_types or self.vision_features
+        if gps_info and self.gps_mode == "skip":
+            return None
+        if gps_info and self.gps_mode == "reduced":
+            feature_types = [feature for feature in feature_types if feature in GPS_VISION_FEATURES]
+            return self.build_annotate_request(content, feature_types) if feature_types else None
+        return self.build_annotate_request(content, feature_types)
+
+    async def process_image(self, image_path: str, feature_profile=None):
         try:
-            print(f"Processing image: {image_path}")
-            with open(image_path, 'rb') as image_file:
-                content = image_file.read()
-
-            image = vision.Image(content=content)
-            features = [
-                types.Feature(type=types.Feature.Type.LANDMARK_DETECTION),
-                types.Feature(type=types.Feature.Type.LABEL_DETECTION),
-                types.Feature(type=types.Feature.Type.WEB_DETECTION),
-                types.Feature(type=types.Feature.Type.IMAGE_PROPERTIES),
-                types.Feature(type=types.Feature.Type.SAFE_SEARCH_DETECTION),
-                types.Feature(type=types.Feature.Type.DOCUMENT_TEXT_DETECTION),
-                types.Feature(type=types.Feature.Type.OBJECT_LOCALIZATION)
-            ]
-
-            request = types.AnnotateImageRequest(image=image, features=features)
-            print("Sending request to Google Vision API...")
-            response = self.client.annotate_image(request=request)
-            print("Received response from Google Vision API")
+            logger.debug("Processing image: %s", image_path)
+            content, content_hash, gps_info = await self.load_image(image_path)
 
+            # A long-lived processor can serve requests that each pick their own feature profile
+            feature_types = VISION_FEATURE_PROFILES[feature_profile] if feature_profile else None
+            request = self.build_request_for_image(content, gps_info, feature_types)
+            cache_key, response = await self.get_cached_annotation(content_hash, request)
+            if request is None:
+                logger.debug("GPS data found in EXIF, skipping Google Vision API for %s", image_path)
+                response = types.AnnotateImageResponse()
+            elif response is None:
+                response = await self.annotate_image(request)
+                await self.cache_annotation(cache_key, response)
+            else:
+                logger.debug("Using cached Google Vision API response for %s", image_path)
+        except Exception as e:
+            logger.error("[PROCESSING ERROR][Image '%s']: %s", image_path, e)
+            return {"error": str(e), "filename": image_path}
+
+        return await self.process_response(image_path, response, content_hash, gps_info)
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=record_retry)
+    async def annotate_image(self, request):
+        # The async client only exposes the batch RPC; a single image is a batch of one
+        async with self.scheduler.limit("vision"):
+            response = await self.client.batch_annotate_images(requests=[request])
+        return response.responses[0]
+
+    async def get_cached_annotation(self, content_hash, request):
+        if self.vision_cache is None or request is None:
+            return None, None
+        variant = f"{self.max_image_edge}:{self.jpeg_quality}" if self.max_image_edge else ""
+        cache_key = VisionCache.make_key(content_hash, request, variant)
+        return cache_key, await self.run_in_executor(self.vision_cache.get, cache_key)
+
+    async def cache_annotation(self, cache_key, response):
+        # Errors are not cached so that a transient failure is retried on the next run
+        if self.vision_cache is None or response.error.message:
+            return
+        await self.run_in_executor(self.vision_cache.put, cache_key, response)
+
+    async def run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def read_image_file(self, image_path):
+        with open(image_path, 'rb') as image_file:
+            content = image_file.read()
+        return content, hashlib.sha256(content).hexdigest()
+
+    async def load_image(self, image_path):
+        # Outside "full" mode EXIF is read first so that the Vision request can depend on it.
+        # GPS always comes from the original file, never from the downscaled copy.
+        gps_info = None
+        if self.gps_mode != "full":
+            gps_info = await self.run_in_executor(self.get_gps_from_exif, image_path)
+        with self.metrics.span("file_read"):
+            if self.max_image_edge:
+                loop = asyncio.get_running_loop()
+                content, content_hash = await loop.run_in_executor(
+                    self.process_pool, read_image_for_vision, image_path, self.max_image_edge, self.jpeg_quality)
+            elif image_path.lower().endswith(CONVERTED_EXTENSIONS):
+                content, content_hash = await self.run_in_executor(
+                    read_image_for_vision, image_path, None, self.jpeg_quality)
+            else:
+                content, content_hash = await self.run_in_executor(self.read_image_file, image_path)
+        return content, content_hash, gps_info
+
+    async def group_into_batches(self, image_files):
+        # The size on disk says nothing about what is uploaded once images are downscaled; then only the
+        # number of images counts here, and process_image_batch splits by the bytes that are actually sent
+        batch = []
+        batch_bytes = 0
+        async for image_file in as_async_iterator(image_files):
+            try:
+                size = 0 if self.max_image_edge else os.path.getsize(image_file)
+            except OSError:
+                size = 0
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.batch_max_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(image_file)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def split_by_bytes(self, items):
+        # items are (image_path, cache_key, request, size) for one batch; a request must stay within batch_max_bytes
+        chunk = []
+        chunk_bytes = 0
+        for item in items:
+            if chunk and chunk_bytes + item[3] > self.batch_max_bytes:
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(item)
+            chunk_bytes += item[3]
+        if chunk:
+            yield chunk
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=record_retry)
+    async def annotate_batch(self, requests):
+        async with self.scheduler.limit("vision"):
+            response = await self.client.batch_annotate_images(requests=requests)
+        return list(response.responses)
+
+    async def process_image_batch(self, image_paths: list[str], feature_profile=None):
+        feature_types = VISION_FEATURE_PROFILES[feature_profile] if feature_profile else None
+        results = {}
+        pending = []
+        cached = {}
+        content_hashes = {}
+        gps_infos = {}
+        contents = await asyncio.gather(*[
+            self.load_image(image_path) for image_path in image_paths
+        ], return_exceptions=True)
+        for image_path, loaded in zip(image_paths, contents):
+            try:
+                logger.debug("Processing image: %s", image_path)
+                if isinstance(loaded, Exception):
+                    raise loaded
+                content, content_hashes[image_path], gps_infos[image_path] = loaded
+                request = self.build_request_for_image(content, gps_infos[image_path], feature_types)
+                if request is None:
+                    logger.debug("GPS data found in EXIF, skipping Google Vision API for %s", image_path)
+                    cached[image_path] = types.AnnotateImageResponse()
+                    continue
+                cache_key, response = await self.get_cached_annotation(content_hashes[image_path], request)
+                if response is not None:
+                    logger.debug("Using cached Google Vision API response for %s", image_path)
+                    cached[image_path] = response
+                    continue
+                pending.append((image_path, cache_key, request, len(content)))
+            except Exception as e:
+                logger.error("[PROCESSING ERROR][Image '%s']: %s", image_path, e)
+                results[image_path] = {"error": str(e), "filename": image_path}
+
+        responses = dict(cached)
+
+        async def annotate(chunk):
+            try:
+                logger.debug("Sending batch of %d images to Google Vision API", len(chunk))
+                batch_responses = await self.annotate_batch([request for _, _, request, _ in chunk])
+            except Exception as e:
+                logger.error("[VISION BATCH ERROR]: %s", e)
+                for image_path, _, _, _ in chunk:
+                    results[image_path] = {"error": str(e), "filename": image_path}
+            else:
+                for (image_path, cache_key, _, _), response in zip(chunk, batch_responses):
+                    await self.cache_annotation(cache_key, response)
+                    responses[image_path] = response
+
+        await asyncio.gather(*[annotate(chunk) for chunk in self.split_by_bytes(pending)])
+
+        # Each response carries its own error status, so a bad image only fails its own pipeline
+        batch_results = await asyncio.gather(*[
+            self.process_response(image_path, response, content_hashes[image_path], gps_infos[image_path])
+            for image_path, response in responses.items()
+        ])
+        results.update(zip(responses.keys(), batch_results))
+
+        return [results[image_path] for image_path in image_paths]
+
+    async def process_response(self, image_path: str, response, content_hash=None, gps_info=None):
+        try:
             if response.error.message:
                 raise Exception(f"[VISION API ERROR] - {response.error.message}")
 
-            print("Extracting data from response...")
-            result_data = self.extract_data_from_response(response, image_path)
-            print("Data extraction complete")
-
-            print("Extracting text coordinates...")
-            text_coordinates = self.extract_text_coordinates(response)
-            result_data["text_coordinates"] = text_coordinates
-            print("Text coordinate extraction complete")
+            with self.metrics.span("extraction"):
+                result_data = self.extract_data_from_response(response, image_path)
+                ocr_text, boxes = extract_ocr_text(response, with_boxes=self.ocr_format != "none")
+            if self.ocr_format == "compact":
+                result_data["ocr_text"] = {"text": ocr_text, "boxes": boxes}
+            elif self.ocr_format == "words":
+                result_data["text_coordinates"] = words_with_boxes(ocr_text, boxes)
 
-            print("Checking for GPS data in EXIF...")
-            gps_info = self.get_gps_from_exif(image_path)
+            if gps_info is None and self.gps_mode == "full":
+                gps_info = await self.run_in_executor(self.get_gps_from_exif, image_path)
             if gps_info:
-                print(f"GPS data found: {gps_info}")
+                logger.debug("GPS data found for %s: %s", image_path, gps_info)
                 result_data["gps_location"] = gps_info
-                print("Reverse geocoding GPS coordinates...")
-                address = await self.reverse_geocode(gps_info["latitude"], gps_info["longitude"])
-                if address:
-                    print(f"Address found: {address}")
-                    result_data["address"] = address
-                    place_details = await self.get_place_details(address["place_id"])
-                    if place_details:
-                        result_data["place_details"] = place_details
-                    street_view = await self.get_street_view(gps_info["latitude"], gps_info["longitude"])
-                    if street_view:
-                        result_data["street_view"] = street_view
+                await self.enrich_location(result_data, gps_info["latitude"], gps_info["longitude"])
             elif result_data.get("landmarks"):
-                print(f"Landmarks found: {result_data['landmarks']}")
+                logger.debug("Landmarks found for %s: %s", image_path, result_data['landmarks'])
                 landmark = result_data["landmarks"][0]
                 result_data["location"] = {"lat": landmark["latitude"], "lng": landmark["longitude"]}
-                print("Reverse geocoding landmark coordinates...")
-                address = await self.reverse_geocode(landmark["latitude"], landmark["longitude"])
-                if address:
-                    print(f"Address found: {address}")
-                    result_data["address"] = address
-                    place_details = await self.get_place_details(address["place_id"])
-                    if place_details:
-                        result_data["place_details"] = place_details
-                    street_view = await self.get_street_view(landmark["latitude"], landmark["longitude"])
-                    if street_view:
-                        result_data["street_view"] = street_view
+                await self.enrich_location(result_data, landmark["latitude"], landmark["longitude"])
             else:
-                print("No GPS data or landmarks found. Attempting to get location from text...")
-                location = await self.get_location_from_text(text_coordinates)
+                strategy, location = await self.find_location(self.location_strategies(result_data, ocr_text))
                 if location:
-                    print(f"Location found from text: {location}")
+                    logger.debug("Location found for %s from %s: %s", image_path, strategy, location)
                     result_data["location"] = location
-                    print("Reverse geocoding location...")
-                    address = await self.reverse_geocode(location["lat"], location["lng"])
-                    if address:
-                        print(f"Address found: {address}")
-                        result_data["address"] = address
-                        place_details = await self.get_place_details(address["place_id"])
-                        if place_details:
-                            result_data["place_details"] = place_details
-                        street_view = await self.get_street_view(location["lat"], location["lng"])
-                        if street_view:
-                            result_data["street_view"] = street_view
+                    await self.enrich_location(result_data, location["lat"], location["lng"])
                 else:
-                    print("No location found from text. Attempting to get location from Google Maps API using labels...")
-                    location = await self.get_location_from_google_maps_api(result_data["labels"][:3])
-                    if location:
-                        print(f"Location found from Google Maps API using labels: {location}")
-                        result_data["location"] = location
-                        print("Reverse geocoding location...")
-                        address = await self.reverse_geocode(location["lat"], location["lng"])
-                        if address:
-                            print(f"Address found: {address}")
-                            result_data["address"] = address
-                            place_details = await self.get_place_details(address["place_id"])
-                            if place_details:
-                                result_data["place_details"] = place_details
-                            street_view = await self.get_street_view(location["lat"], location["lng"])
-                            if street_view:
-                                result_data["street_view"] = street_view
-                    else:
-                        print("No location found from Google Maps API using labels. Attempting with web entities...")
-                        web_entities = [{"label": entity["entity"]} for entity in result_data["web_entities"][:3]]
-                        location = await self.get_location_from_google_maps_api(web_entities)
-                        if location:
-                            print(f"Location found from Google Maps API using web entities: {location}")
-                            result_data["location"] = location
-                            print("Reverse geocoding location...")
-                            address = await self.reverse_geocode(location["lat"], location["lng"])
-                            if address:
-                                print(f"Address found: {address}")
-                                result_data["address"] = address
-                                place_details = await self.get_place_details(address["place_id"])
-                                if place_details:
-                                    result_data["place_details"] = place_details
-                                street_view = await self.get_street_view(location["lat"], location["lng"])
-                                if street_view:
-                                    result_data["street_view"] = street_view
-                        else:
-                            print("No location found from any method")
-
-            print("Saving intermediate result...")
-            await self.save_intermediate_result(result_data)
-            print("Processing complete")
+                    logger.debug("No location found for %s from any method", image_path)
+
+            with self.metrics.span("save"):
+                await self.save_intermediate_result(result_data, content_hash)
             return result_data
 
         except Exception as e:
-            print(f"[PROCESSING ERROR][Image '{image_path}']: {str(e)}")
+            logger.error("[PROCESSING ERROR][Image '%s']: %s", image_path, e)
             return {"error": str(e), "filename": image_path}
 
-    async def get_location_from_text(self, text_coordinates):
-        location_text = " ".join([item["text"] for item in text_coordinates])
+    async def get_location_from_text(self, ocr_text):
+        # Only the most address- and place-like text goes into the query, not every word on the photo
+        location_text = select_location_text(ocr_text, self.location_text_max_chars)
         return await self.get_location_from_google_maps_api([{"label": location_text}])
 
+    def location_strategies(self, result_data, ocr_text):
+        # Listed in priority order: an earlier strategy's answer always wins over a later one
+        web_entities = [{"label": entity["entity"]} for entity in result_data["web_entities"][:3]]
+        return [
+            ("text", lambda: self.get_location_from_text(ocr_text)),
+            ("Google Maps API using labels", lambda: self.get_location_from_google_maps_api(result_data["labels"][:3])),
+            ("Google Maps API using web entities", lambda: self.get_location_from_google_maps_api(web_entities))
+        ]
+
+    async def find_location(self, strategies):
+        tasks = [None] * len(strategies)
+
+        def start(index):
+            if tasks[index] is None:
+                tasks[index] = asyncio.ensure_future(strategies[index][1]())
+
+        try:
+            for index, (name, _) in enumerate(strategies):
+                start(index)
+                # While the highest-priority strategy is still running, start the next one every
+                # strategy_hedge_delay seconds (0 runs them all at once, None runs them one after another)
+                while not tasks[index].done():
+                    waiting = [later for later in range(index + 1, len(strategies)) if tasks[later] is None]
+                    timeout = self.strategy_hedge_delay if waiting and self.strategy_hedge_delay is not None else None
+                    done, _ = await asyncio.wait({tasks[index]}, timeout=timeout)
+                    if not done:
+                        start(waiting[0])
+                try:
+                    location = tasks[index].result()
+                except Exception as e:
+                    logger.warning("Location lookup from %s failed: %s", name, e)
+                    location = None
+                if location:
+                    return name, location
+            return None, None
+        finally:
+            # Lower-priority lookups are no longer needed once a result is chosen
+            for task in tasks:
+                if task is None:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    async def enrich_location(self, result_data, lat, lng):
+        address = await self.reverse_geocode(lat, lng)
+        if not address:
+            return
+        result_data["address"] = address
+        place_details, street_view = await asyncio.gather(
+            self.get_place_details(address["place_id"]),
+            self.get_street_view(lat, lng)
+        )
+        if place_details:
+            result_data["place_details"] = place_details
+        if street_view:
+            result_data["street_view"] = street_view
+
     def extract_data_from_response(self, response, image_path):
         result_data = {
             "filename": image_path,
@@ -203,14 +558,16 @@ class ImageProcessor:
                 "pixel_fraction": float(color.pixel_fraction)
             } for color in colors[:5]]
 
-            safe_search = response.safe_search_annotation
-            result_data["safe_search"] = {
-                "adult": safe_search.adult.name,
-                "medical": safe_search.medical.name,
-                "spoofed": safe_search.spoof.name,
-                "violence": safe_search.violence.name,
-                "racy": safe_search.racy.name
-            }
+            # An unset annotation would otherwise read as UNKNOWN for every category
+            if "safe_search_annotation" in response:
+                safe_search = response.safe_search_annotation
+                result_data["safe_search"] = {
+                    "adult": safe_search.adult.name,
+                    "medical": safe_search.medical.name,
+                    "spoofed": safe_search.spoof.name,
+                    "violence": safe_search.violence.name,
+                    "racy": safe_search.racy.name
+                }
 
             for object_annotation in response.localized_object_annotations:
                 result_data["objects"].append({
@@ -223,23 +580,27 @@ class ImageProcessor:
                 })
 
         except Exception as e:
-            print(f"Error extracting data from response: {str(e)}")
+            logger.error("Error extracting data from response for %s: %s", image_path, e)
             result_data["error"] = str(e)
 
         return result_data
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=record_retry)
     async def get_location_from_google_maps_api(self, object_labels: list[str]):
         query = " ".join(label["label"] for label in object_labels)
+        # Feature profiles without OCR, labels or web detection leave nothing to search for
+        if not query.strip():
+            return None
         encoded_query = quote(query)
-        url = f"https://places.googleapis.com/v1/places:searchText"
+        url = f"{self.places_api_url}/places:searchText"
         headers = {
             "Content-Type": "application/json",
             "X-Goog-Api-Key": self.api_key,
             "X-Goog-FieldMask": "places.displayName,places.formattedAddress,places.location,places.types"
         }
         data = json.dumps({"textQuery": encoded_query})
-        async with self.session.post(url, headers=headers, data=data) as response:
+        async with self.scheduler.limit("places_text_search"), self.session.post(url, headers=headers, data=data) as response:
+            self.check_api_status("places_text_search", response.status)
             if response.status == 200:
                 data = await response.json()
                 if data.get("places"):
@@ -253,17 +614,25 @@ class ImageProcessor:
                     }
         return None
 
-    async def get_location_from_text(self, text_coordinates):
-        location_text = " ".join([item["text"] for item in text_coordinates])
-        return await self.get_location_from_google_maps_api([{"label": location_text}])
+    def check_api_status(self, api, status, api_status=None):
+        if status == 429 or api_status == "OVER_QUERY_LIMIT":
+            raise RateLimitedError(f"[{api.upper()} API ERROR] - rate limited")
+        # Other failures are answered rather than raised, so the limiter never sees them
+        if status != 200 or api_status not in (None, "OK", "ZERO_RESULTS"):
+            self.metrics.count_api(api, "errors")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     async def reverse_geocode(self, lat: float, lng: float):
-        url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lng}&key={self.api_key}"
-        async with self.session.get(url) as response:
+        return await self.geo_cache.get_or_fetch(
+            "reverse_geocode", self.geo_cache.cell(lat, lng), lambda: self._reverse_geocode(lat, lng))
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=record_retry)
+    async def _reverse_geocode(self, lat: float, lng: float):
+        url = f"{self.maps_api_url}/geocode/json?latlng={lat},{lng}&key={self.api_key}"
+        async with self.scheduler.limit("geocoding"), self.session.get(url) as response:
+            self.check_api_status("geocoding", response.status)
             if response.status == 200:
                 data = await response.json()
+                self.check_api_status("geocoding", response.status, data.get("status"))
                 if data["status"] == "OK" and data["results"]:
                     result = data["results"][0]
                     return {
@@ -273,12 +642,18 @@ class ImageProcessor:
                     }
         return None
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     async def get_place_details(self, place_id: str):
-        url = f"https://maps.googleapis.com/maps/api/place/details/json?place_id={place_id}&fields=name,rating,formatted_phone_number&key={self.api_key}"
-        async with self.session.get(url) as response:
+        return await self.geo_cache.get_or_fetch(
+            "place_details", place_id, lambda: self._get_place_details(place_id))
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=record_retry)
+    async def _get_place_details(self, place_id: str):
+        url = f"{self.maps_api_url}/place/details/json?place_id={place_id}&fields=name,rating,formatted_phone_number&key={self.api_key}"
+        async with self.scheduler.limit("place_details"), self.session.get(url) as response:
+            self.check_api_status("place_details", response.status)
             if response.status == 200:
                 data = await response.json()
+                self.check_api_status("place_details", response.status, data.get("status"))
                 if data["status"] == "OK":
                     result = data["result"]
                     return {
@@ -288,30 +663,68 @@ class ImageProcessor:
                     }
         return None
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     async def get_street_view(self, lat: float, lng: float):
-        url = f"https://maps.googleapis.com/maps/api/streetview?size=600x300&location={lat},{lng}&key={self.api_key}"
-        async with self.session.get(url) as response:
+        if self.street_view_mode == "lazy":
+            return {"lat": lat, "lng": lng, "size": STREET_VIEW_SIZE}
+        cache_key = f"{self.geo_cache.cell(lat, lng)}:{STREET_VIEW_SIZE}"
+        if self.street_view_mode == "file":
+            return await self.geo_cache.get_or_fetch(
+                "street_view_file", cache_key, lambda: self.save_street_view(lat, lng))
+        return await self.geo_cache.get_or_fetch(
+            "street_view", cache_key, lambda: self._get_street_view(lat, lng))
+
+    async def _get_street_view(self, lat: float, lng: float):
+        image_data = await self.fetch_street_view_image(lat, lng)
+        if image_data is None:
+            return None
+        return base64.b64encode(image_data).decode('utf-8')
+
+    def street_view_path(self, lat: float, lng: float):
+        cell = encode_geohash(lat, lng, self.geo_cache_precision)
+        return Path(self.street_view_dir) / f"{cell}_{STREET_VIEW_SIZE}.jpg"
+
+    async def save_street_view(self, lat: float, lng: float):
+        path = self.street_view_path(lat, lng)
+        # Photos from the same spot share one image file
+        if not path.exists():
+            image_data = await self.fetch_street_view_image(lat, lng)
+            if image_data is None:
+                return None
+            await self.run_in_executor(self.write_street_view_file, path, image_data)
+        return {"file": str(path), "lat": lat, "lng": lng, "size": STREET_VIEW_SIZE}
+
+    def write_street_view_file(self, path, image_data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(image_data)
+        os.replace(temp_path, path)
+
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=record_retry)
+    async def fetch_street_view_image(self, lat: float, lng: float):
+        url = f"{self.maps_api_url}/streetview?size={STREET_VIEW_SIZE}&location={lat},{lng}&key={self.api_key}"
+        async with self.scheduler.limit("street_view"), self.session.get(url) as response:
+            self.check_api_status("street_view", response.status)
             if response.status == 200:
-                image_data = await response.read()
-                return base64.b64encode(image_data).decode('utf-8')
+                return await response.read()
         return None
 
-    def get_files_by_extension(self, extensions: list[str]):
-        return [f for ext in extensions for f in Path(self.image_dir).glob(f"*.{ext}")]
-
-    async def save_intermediate_result(self, result_data):
-        intermediate_file = Path(f'intermediate_results_{int(time.time())}.json')
-        with intermediate_file.open("w") as f:
-            json.dump(result_data, f, indent=4)
-        print(f"Intermediate result saved to '{intermediate_file.absolute()}'.")
+    async def save_intermediate_result(self, result_data, content_hash=None):
+        if self.result_store is None:
+            return
+        self.result_store.add(result_data, content_hash)
 
     def get_gps_from_exif(self, image_path):
+        with self.metrics.span("exif"):
+            return self.read_gps_from_exif(image_path)
+
+    def read_gps_from_exif(self, image_path):
         try:
+            # Image.open only parses the file header; pixel data is never decoded here
             with Image.open(image_path) as img:
-                exif = {TAGS[k]: v for k, v in img._getexif().items() if k in TAGS}
-                if 'GPSInfo' in exif:
-                    gps_info = {GPSTAGS[k]: v for k, v in exif['GPSInfo'].items() if k in GPSTAGS}
+                gps_ifd = img.getexif().get_ifd(GPS_IFD_TAG)
+                gps_info = {GPSTAGS[k]: v for k, v in gps_ifd.items() if k in GPSTAGS}
+                if 'GPSLatitude' in gps_info and 'GPSLongitude' in gps_info:
                     lat = gps_info['GPSLatitude']
                     lon = gps_info['GPSLongitude']
                     lat_ref = gps_info['GPSLatitudeRef']
@@ -325,73 +738,365 @@ class ImageProcessor:
                     
                     return {"latitude": lat, "longitude": lon}
         except Exception as e:
-            print(f"Error extracting EXIF data from {image_path}: {e}")
+            logger.warning("Error extracting EXIF data from %s: %s", image_path, e)
         return None
 
-    def extract_text_coordinates(self, response):
-        coordinates = []
-        for page in response.full_text_annotation.pages:
-            for block in page.blocks:
-                for paragraph in block.paragraphs:
-                    for word in paragraph.words:
-                        box = word.bounding_box
-                        coords = [(vertex.x, vertex.y) for vertex in box.vertices]
-                        coordinates.append({
-                            'text': ''.join([symbol.text for symbol in word.symbols]),
-                            'coords': coords
-                        })
-        return coordinates
+    def prescan_exif(self):
+        image_files = list(FileScanner().scan(self.image_dir, incremental=False))
+        with ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            with_gps = sum(1 for gps_info in executor.map(self.get_gps_from_exif, image_files) if gps_info)
+        logger.info("EXIF pre-scan: %d of %d images have GPS coordinates and can skip or reduce the "
+                    "Google Vision API request (gps_mode 'skip' or 'reduced').", with_gps, len(image_files))
+        return {"images": len(image_files), "with_gps": with_gps}
 
-    async def process_images(self):
-        await self.initialize()
-        image_files = self.get_files_by_extension(["png", "jpg", "jpeg"])
-        num_images = len(image_files)
-        if num_images == 0:
-            print("No images found in the specified directory.")
-            return
+    async def scan_images(self, scanner, incremental=True, skip=()):
+        # Directories are listed in the I/O pool one at a time, so the first images are processed
+        # while the rest of the tree is still being scanned
+        directories = [os.path.normpath(self.image_dir)]
+        while directories:
+            files, subdirectories = await self.run_in_executor(scanner.scan_directory, directories.pop(), incremental)
+            directories.extend(reversed(subdirectories))
+            for image_file in files:
+                if image_file not in skip:
+                    yield image_file
+
+    async def hold_for_confirmation(self, image_files, threshold=100):
+        # Nothing is processed until it is clear whether the run is large enough to need confirmation
+        held = []
+        async for image_file in image_files:
+            held.append(image_file)
+            if len(held) > threshold:
+                confirm = input(f"WARNING: more than {threshold} images found. Continue? (y/n): ")
+                if not confirm.lower().startswith("y"):
+                    await image_files.aclose()
+                    return None
+                break
+
+        async def release():
+            for image_file in held:
+                yield image_file
+            async for image_file in image_files:
+                yield image_file
+
+        return release()
+
+    def manifest_fingerprint(self):
+        # Everything that changes what is written for an image: a run that differs in any of these
+        # doesn't skip images the manifest recorded for another one
+        settings = [os.path.abspath(self.result_path), self.feature_profile, self.gps_mode, self.ocr_format,
+                    self.location_text_max_chars, self.street_view_mode]
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16]
 
-        print(f"{num_images} image files found.")
+    def trusts_manifest(self, manifest, rescan):
+        # Skipped images only have results if the result file they were appended to is still there
+        return manifest is not None and not rescan and os.path.exists(self.result_path)
 
-        if num_images > 100 and self.prompt_for_confirmation:
-            confirm = input(f"WARNING: {num_images} images found. Continue? (y/n): ")
-            if not confirm.lower().startswith("y"):
-                print("Operation cancelled.")
+    async def process_images(self, resume=False, rescan=False):
+        await self.initialize()
+        scanner = FileScanner(self.scan_manifest)
+        incremental = self.trusts_manifest(self.scan_manifest, rescan)
+        completed = set()
+        if resume:
+            completed = load_completed_filenames(self.result_path)
+            logger.info("Resuming: skipping %d images already in '%s'.", len(completed), self.result_path)
+        image_files = self.scan_images(scanner, incremental, completed)
+        if self.prompt_for_confirmation:
+            image_files = await self.hold_for_confirmation(image_files)
+            if image_files is None:
+                logger.info("Operation cancelled.")
+                await self.close()
                 return
 
-        tasks = [self.process_image(str(img_f)) for img_f in image_files]
-        results = await asyncio.gather(*tasks)
+        # With a scan manifest only new and changed images are processed, so earlier results are kept
+        count = await self.process_image_files(image_files, self.result_path, append=resume or incremental)
+        logger.info(scanner.summary())
+        if count == 0:
+            logger.info("No new or changed images found in the specified directory.")
+        if self.vision_cache:
+            logger.info(self.vision_cache.summary())
+        logger.info(self.geo_cache.summary())
+        logger.info("Time per stage:\n%s", self.metrics.stage_table())
+        if self.metrics_path:
+            self.write_metrics(self.metrics_path)
+            logger.info("Metrics saved to '%s'.", self.metrics_path)
+        await self.close()
+
+    def write_metrics(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.metrics.summary(), f, indent=2)
+
+    async def process_image_files(self, image_files, result_path, append=False, feature_profile=None, on_result=None):
+        # Results are appended as each image finishes, so nothing is lost if the run is interrupted
+        writer = ResultWriter(result_path, append=append)
+
+        def write(result):
+            self.metrics.count_image("failed" if "error" in result else "done")
+            writer.write(result)
+            if self.scan_manifest and "error" not in result:
+                self.scan_manifest.mark_processed(result["filename"])
+            if on_result:
+                on_result(result)
+
+        async def process_and_write(image_file):
+            with self.metrics.span("image"):
+                result = await self.process_image(image_file, feature_profile)
+            write(result)
+
+        async def process_batch_and_write(batch):
+            start = time.perf_counter()
+            results = await self.process_image_batch(batch, feature_profile)
+            # Every image in a batch waits for the whole batch
+            for result in results:
+                self.metrics.observe("image", time.perf_counter() - start)
+                write(result)
+
+        try:
+            if self.batch_size > 1:
+                batches = self.group_into_batches(image_files)
+                logger.info("Sending images to Google Vision API in batches of up to %d.", self.batch_size)
+                # Each batch occupies one worker, so scale the worker count down to keep the same number of images in flight
+                workers = max(1, self.max_concurrent_images // self.batch_size)
+                await self.scheduler.run(batches, process_batch_and_write, workers, weight=len)
+            else:
+                await self.scheduler.run(image_files, process_and_write, self.max_concurrent_images)
+        finally:
+            writer.close()
+
+        logger.info("Processing completed. %d results saved to '%s'.", writer.count, writer.path.absolute())
+        return writer.count
 
-        result_file = Path('result.json')
-        with result_file.open("w") as f:
-            json.dump(results, f, indent=4)
+    def distribute_images(self, work_queue_path, worker_command, workers, resume=False, rescan=False,
+                          poll_interval=DEFAULT_POLL_INTERVAL):
+        # Coordinator of a distributed run: queues the images, starts local workers and merges their results.
+        # Workers on other machines join by running worker_command against the same queue file.
+        manifest = ScanManifest(self.scan_manifest_path, self.manifest_fingerprint()) if self.scan_manifest_path else None
+        incremental = self.trusts_manifest(manifest, rescan)
+        scanner = FileScanner(manifest)
+        work_queue = WorkQueue(work_queue_path)
+        if not resume:
+            work_queue.reset()
+        work_queue.set_producing(True)
+        processes = [subprocess.Popen(worker_command) for _ in range(workers)]
+        logger.info("Started %d workers on '%s'.", workers, work_queue_path)
 
-        print(f"Processing completed. Results saved to '{result_file.absolute()}'.")
-        await self.session.close()
+        # Absolute paths, so that workers started from another directory or machine find the same files
+        image_files = []
+        for image_file in scanner.scan(os.path.abspath(self.image_dir), incremental):
+            stat = os.stat(image_file)
+            image_files.append((image_file, stat.st_size, stat.st_mtime_ns))
+            if len(image_files) >= ADD_BATCH_SIZE:
+                work_queue.add(image_files)
+                image_files = []
+        work_queue.add(image_files)
+        work_queue.set_producing(False)
+        logger.info(scanner.summary())
 
-    def process_single_image(self, image_path):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        last_report = time.monotonic()
+        while not work_queue.is_finished():
+            if processes and all(process.poll() is not None for process in processes):
+                logger.error("All workers exited before every image was processed.")
+                break
+            time.sleep(poll_interval)
+            if self.progress_interval and time.monotonic() - last_report >= self.progress_interval:
+                logger.info("Progress: %s", ", ".join(f"{count} {status}" for status, count in work_queue.counts().items()))
+                last_report = time.monotonic()
+        for process in processes:
+            process.wait()
+
+        # With a scan manifest only new and changed images were queued, and a resumed queue only merges
+        # what finished since its last merge, so earlier results are kept
+        result_store = ResultStore(self.result_store_path) if self.result_store_path else None
         try:
-            return loop.run_until_complete(self._process_single_image(image_path))
+            done, failed = work_queue.merge_results(self.result_path, append=resume or incremental,
+                                                    result_store=result_store)
         finally:
-            loop.close()
+            if result_store:
+                result_store.close()
+        work_queue.close()
+        if manifest:
+            for image_file in done:
+                manifest.mark_processed(image_file)
+            manifest.close()
+        logger.info("Processing completed. %d images done, %d failed; results saved to '%s'.",
+                    len(done), len(failed), os.path.abspath(self.result_path))
 
-    async def _process_single_image(self, image_path):
+    async def process_work_queue(self, work_queue_path, poll_interval=DEFAULT_POLL_INTERVAL):
+        # Worker of a distributed run: the same pipeline as process_images, fed from the shared queue
+        work_queue = WorkQueue(work_queue_path)
+        worker = worker_name()
+        if self.result_store_path:
+            # Each worker has a store of its own next to the queue, which the coordinator merges into result_store_path
+            self.result_store = ResultStore(work_queue.shard_path(worker, ".sqlite3"), wal=False)
         await self.initialize()
-        result = await self.process_image(image_path)
+        held = set()
+        finished = []
+
+        def on_result(result):
+            held.discard(result["filename"])
+            finished.append((result["filename"], result.get("error")))
+
+        logger.info("Worker %s processing images from '%s'.", worker, work_queue_path)
+        heartbeat = asyncio.ensure_future(self.keep_leases(work_queue, worker, held, finished, poll_interval))
+        count = 0
+        try:
+            while True:
+                image_files = await self.run_in_executor(work_queue.claim, worker, DEFAULT_CLAIM_SIZE)
+                if image_files:
+                    count += await self.process_image_files(
+                        self.claim_images(work_queue, worker, held, image_files),
+                        work_queue.shard_path(worker), append=True, on_result=on_result)
+                    continue
+                # Images of other workers come back to the queue when they fail or their lease expires
+                await self.report_finished(work_queue, worker, finished)
+                if await self.run_in_executor(work_queue.is_finished):
+                    break
+                await asyncio.sleep(poll_interval)
+        finally:
+            heartbeat.cancel()
+            await self.report_finished(work_queue, worker, finished)
+            work_queue.close()
+        logger.info("Worker %s finished %d images.", worker, count)
+        self.write_metrics(work_queue.shard_dir / f"{worker}.metrics.json")
+        await self.close()
+
+    async def claim_images(self, work_queue, worker, held, image_files):
+        # Ends as soon as nothing is left to claim, rather than waiting for more, so that a partly
+        # filled Vision batch is sent instead of holding its leased images back
+        while image_files:
+            held.update(image_files)
+            for image_file in image_files:
+                yield image_file
+            image_files = await self.run_in_executor(work_queue.claim, worker, DEFAULT_CLAIM_SIZE)
+
+    async def keep_leases(self, work_queue, worker, held, finished, poll_interval):
+        last_renewal = time.monotonic()
+        while True:
+            await asyncio.sleep(poll_interval)
+            await self.report_finished(work_queue, worker, finished)
+            if time.monotonic() - last_renewal >= work_queue.lease_seconds / 3:
+                await self.run_in_executor(work_queue.renew, worker, list(held))
+                last_renewal = time.monotonic()
+
+    async def report_finished(self, work_queue, worker, finished):
+        # Outcomes are written in one transaction per round rather than one per image
+        outcomes = finished[:]
+        del finished[:]
+        if outcomes:
+            if self.result_store:
+                # The coordinator merges an image's rows as soon as it is done, so they must be committed first
+                self.result_store.commit()
+            await self.run_in_executor(work_queue.finish, worker, outcomes)
+
+    async def close(self):
         if self.session:
             await self.session.close()
-        return result
+            self.session = None
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False)
+            self.process_pool = None
+        if self.vision_cache:
+            self.vision_cache.close()
+            self.vision_cache = None
+        if self.geo_cache:
+            self.geo_cache.close()
+            self.geo_cache = None
+        if self.result_store:
+            self.result_store.close()
+            self.result_store = None
+        if self.scan_manifest:
+            self.scan_manifest.close()
+            self.scan_manifest = None
+
 
 if __name__ == "__main__":
-    with open('config.json', 'r') as config_file:
+    parser = argparse.ArgumentParser(description="Find where the photos in a directory were taken.")
+    parser.add_argument("--config", default="config.json", help="path to the configuration file")
+    parser.add_argument("--output", help=f"JSON Lines file results are written to (default: {DEFAULT_RESULT_PATH})")
+    parser.add_argument("--resume", action="store_true", help="append to the output file and skip images already in it")
+    parser.add_argument("--rescan", action="store_true",
+                        help="process every image, including those unchanged since they were last processed")
+    parser.add_argument("--gps-mode", choices=GPS_MODES,
+                        help="how to treat images with GPS coordinates in EXIF (overrides gps_mode in the config)")
+    parser.add_argument("--feature-profile", choices=list(VISION_FEATURE_PROFILES),
+                        help="set of Vision features to request (overrides feature_profile in the config)")
+    parser.add_argument("--ocr-format", choices=OCR_FORMATS,
+                        help="how OCR text is kept in the results (overrides ocr_format in the config)")
+    parser.add_argument("--workers", type=int,
+                        help="process the images in this many worker processes, coordinated through the work queue")
+    parser.add_argument("--worker", action="store_true",
+                        help="only run as a worker, taking images from the work queue of a coordinator")
+    parser.add_argument("--work-queue",
+                        help=f"SQLite work queue shared by the coordinator and its workers (default: {DEFAULT_WORK_QUEUE_PATH})")
+    parser.add_argument("--log-level", choices=LOG_LEVELS,
+                        help="how much progress to log, or 'off' (overrides log_level in the config)")
+    parser.add_argument("--prescan", action="store_true",
+                        help="only report how many images have GPS coordinates in EXIF, without calling any API")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as config_file:
         config = json.load(config_file)
+    configure_logging(args.log_level or config.get('log_level', 'info'))
+    if args.worker:
+        # The caches use SQLite's WAL mode, which doesn't work on a network filesystem. Workers, which may
+        # run on other machines, only keep them on disk when given paths of their own on a local disk.
+        vision_cache_path = config.get('worker_vision_cache_path')
+        geo_cache_path = config.get('worker_geo_cache_path')
+    else:
+        vision_cache_path = config.get('vision_cache_path', 'vision_cache.sqlite3')
+        geo_cache_path = config.get('geo_cache_path', 'geo_cache.sqlite3')
     
     processor = ImageProcessor(
         api_key=config['google_api_key'],
         cred_path=config['google_application_credentials_file_path'],
         image_dir=config['image_directory_path'],
-        prompt_for_confirmation=True
+        prompt_for_confirmation=True,
+        batch_size=config.get('vision_batch_size', 1),
+        batch_max_bytes=config.get('vision_batch_max_bytes', DEFAULT_VISION_BATCH_MAX_BYTES),
+        io_workers=config.get('io_workers', DEFAULT_IO_WORKERS),
+        max_concurrent_images=config.get('max_concurrent_images', DEFAULT_MAX_CONCURRENT_IMAGES),
+        api_limits=config.get('api_limits'),
+        progress_interval=config.get('progress_interval', DEFAULT_PROGRESS_INTERVAL),
+        vision_cache_path=vision_cache_path,
+        vision_cache_max_bytes=config.get('vision_cache_max_bytes', DEFAULT_VISION_CACHE_MAX_BYTES),
+        geo_cache_path=geo_cache_path,
+        geo_cache_ttl=config.get('geo_cache_ttl', DEFAULT_GEO_CACHE_TTL),
+        geo_cache_max_entries=config.get('geo_cache_max_entries', DEFAULT_GEO_CACHE_MAX_ENTRIES),
+        geo_cache_precision=config.get('geo_cache_precision', DEFAULT_GEOHASH_PRECISION),
+        result_path=args.output or config.get('result_path', DEFAULT_RESULT_PATH),
+        result_store_path=config.get('result_store_path', DEFAULT_RESULT_STORE_PATH),
+        street_view_mode=config.get('street_view_mode', 'inline'),
+        street_view_dir=config.get('street_view_dir', DEFAULT_STREET_VIEW_DIR),
+        gps_mode=args.gps_mode or config.get('gps_mode', 'full'),
+        feature_profile=args.feature_profile or config.get('feature_profile', DEFAULT_FEATURE_PROFILE),
+        max_image_edge=config.get('max_image_edge'),
+        jpeg_quality=config.get('jpeg_quality', DEFAULT_JPEG_QUALITY),
+        preprocess_workers=config.get('preprocess_workers'),
+        strategy_hedge_delay=config.get('strategy_hedge_delay', DEFAULT_STRATEGY_HEDGE_DELAY),
+        # The coordinator of a distributed run owns the scan manifest
+        scan_manifest_path=None if args.worker else config.get('scan_manifest_path', DEFAULT_SCAN_MANIFEST_PATH),
+        maps_api_url=config.get('maps_api_url', DEFAULT_MAPS_API_URL),
+        places_api_url=config.get('places_api_url', DEFAULT_PLACES_API_URL),
+        metrics_path=config.get('metrics_path', DEFAULT_METRICS_PATH),
+        ocr_format=args.ocr_format or config.get('ocr_format', DEFAULT_OCR_FORMAT),
+        location_text_max_chars=config.get('location_text_max_chars', DEFAULT_LOCATION_TEXT_MAX_CHARS)
     )
     
-    asyncio.run(processor.process_images())
+    work_queue_path = args.work_queue or config.get('work_queue_path', DEFAULT_WORK_QUEUE_PATH)
+    if args.prescan:
+        processor.prescan_exif()
+    elif args.worker:
+        asyncio.run(processor.process_work_queue(work_queue_path))
+    elif args.workers is not None:
+        worker_command = [sys.executable, os.path.abspath(__file__), "--config", args.config,
+                          "--worker", "--work-queue", work_queue_path]
+        for option, value in (("--gps-mode", args.gps_mode), ("--feature-profile", args.feature_profile),
+                              ("--ocr-format", args.ocr_format), ("--log-level", args.log_level)):
+            if value:
+                worker_command += [option, value]
+        processor.distribute_images(work_queue_path, worker_command, args.workers, resume=args.resume,
+                                    rescan=args.rescan)
+    else:
+        asyncio.run(processor.process_images(resume=args.resume, rescan=args.rescan))
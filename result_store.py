@@ -0,0 +1,160 @@
+import argparse
+import json
+import math
+import sqlite3
+import threading
+import time
+
+from grouped_commits import DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL, GroupedCommits
+
+DEFAULT_RESULT_STORE_PATH = 'results.sqlite3'
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def result_coordinates(result):
+    if result.get("gps_location"):
+        return result["gps_location"]["latitude"], result["gps_location"]["longitude"]
+    if result.get("location"):
+        return result["location"]["lat"], result["location"]["lng"]
+    return None, None
+
+
+class ResultStore:
+    def __init__(self, path=DEFAULT_RESULT_STORE_PATH, commit_every=DEFAULT_COMMIT_EVERY,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, wal=True):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.commits = GroupedCommits(self.conn, commit_every, commit_interval)
+        # Without WAL for a store on a network filesystem, which can't share WAL's memory index
+        if wal:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                filename TEXT PRIMARY KEY,
+                content_hash TEXT,
+                latitude REAL,
+                longitude REAL,
+                result TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS result_landmarks (
+                filename TEXT NOT NULL,
+                name TEXT NOT NULL COLLATE NOCASE
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_content_hash ON results(content_hash);
+            CREATE INDEX IF NOT EXISTS idx_results_coordinates ON results(latitude, longitude);
+            CREATE INDEX IF NOT EXISTS idx_result_landmarks_name ON result_landmarks(name);
+            CREATE INDEX IF NOT EXISTS idx_result_landmarks_filename ON result_landmarks(filename);
+        """)
+        self.conn.commit()
+
+    def add(self, result, content_hash=None):
+        filename = result["filename"]
+        latitude, longitude = result_coordinates(result)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (filename, content_hash, latitude, longitude, result, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, content_hash, latitude, longitude, json.dumps(result), time.time())
+            )
+            self.conn.execute("DELETE FROM result_landmarks WHERE filename = ?", (filename,))
+            self.conn.executemany(
+                "INSERT INTO result_landmarks (filename, name) VALUES (?, ?)",
+                [(filename, landmark["name"]) for landmark in result.get("landmarks", [])]
+            )
+            self.commits.changed()
+
+    def commit(self):
+        self.commits.commit()
+
+    def merge(self, path, filenames):
+        # Copies the rows of the given images from another store, such as the one of a distributed run's worker
+        filenames = [(filename,) for filename in filenames]
+        with self.lock:
+            self.commit()
+            self.conn.execute("ATTACH DATABASE ? AS other", (str(path),))
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO results (filename, content_hash, latitude, longitude, result, updated_at) "
+                    "SELECT filename, content_hash, latitude, longitude, result, updated_at FROM other.results "
+                    "WHERE filename = ?", filenames)
+                self.conn.executemany("DELETE FROM result_landmarks WHERE filename = ?", filenames)
+                self.conn.executemany(
+                    "INSERT INTO result_landmarks (filename, name) "
+                    "SELECT filename, name FROM other.result_landmarks WHERE filename = ?", filenames)
+                self.commit()
+            finally:
+                self.conn.execute("DETACH DATABASE other")
+
+    def get(self, filename):
+        row = self.conn.execute("SELECT result FROM results WHERE filename = ?", (filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_content_hash(self, content_hash):
+        rows = self.conn.execute("SELECT result FROM results WHERE content_hash = ?", (content_hash,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def find_by_landmark(self, name):
+        rows = self.conn.execute(
+            "SELECT DISTINCT results.result FROM results "
+            "JOIN result_landmarks ON result_landmarks.filename = results.filename "
+            "WHERE result_landmarks.name = ?",
+            (name,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def find_near(self, latitude, longitude, radius_km):
+        # The bounding box narrows the search through the coordinate index, the exact distance filters the rest
+        lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lng_delta = lat_delta / max(math.cos(math.radians(latitude)), 1e-6)
+        rows = self.conn.execute(
+            "SELECT latitude, longitude, result FROM results "
+            "WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?",
+            (latitude - lat_delta, latitude + lat_delta, longitude - lng_delta, longitude + lng_delta)
+        ).fetchall()
+        matches = []
+        for row_lat, row_lng, result in rows:
+            distance = haversine_km(latitude, longitude, row_lat, row_lng)
+            if distance <= radius_km:
+                matches.append((distance, json.loads(result)))
+        matches.sort(key=lambda match: match[0])
+        return [dict(result, distance_km=distance) for distance, result in matches]
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query processed photo results.")
+    parser.add_argument("--store", default=DEFAULT_RESULT_STORE_PATH, help="path to the result store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    near_parser = subparsers.add_parser("near", help="photos within a radius of a point")
+    near_parser.add_argument("latitude", type=float)
+    near_parser.add_argument("longitude", type=float)
+    near_parser.add_argument("radius_km", type=float)
+    landmark_parser = subparsers.add_parser("landmark", help="photos showing a landmark")
+    landmark_parser.add_argument("name")
+    file_parser = subparsers.add_parser("file", help="result for a single image")
+    file_parser.add_argument("filename")
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    if args.command == "near":
+        results = store.find_near(args.latitude, args.longitude, args.radius_km)
+    elif args.command == "landmark":
+        results = store.find_by_landmark(args.name)
+    else:
+        results = [result for result in [store.get(args.filename)] if result]
+    store.close()
+    print(json.dumps(results, indent=4))
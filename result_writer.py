@@ -0,0 +1,46 @@
+import json
+from pathlib import Path
+
+
+def read_lines(path):
+    with Path(path).open("r") as f:
+        for number, line in enumerate(f):
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line behind
+                continue
+            if isinstance(result, dict):
+                yield number, result
+
+
+def iter_results(path):
+    # Runs that append to the same file (--resume, a scan manifest, a changed image) can leave several
+    # lines for one image; only the last one is current. The file is read twice rather than held in memory.
+    last_lines = {}
+    for number, result in read_lines(path):
+        last_lines[result.get("filename")] = number
+    for number, result in read_lines(path):
+        if last_lines[result.get("filename")] == number:
+            yield result
+
+
+def load_completed_filenames(path):
+    if not Path(path).exists():
+        return set()
+    return {result.get("filename") for result in iter_results(path) if "error" not in result}
+
+
+class ResultWriter:
+    def __init__(self, path, append=False):
+        self.path = Path(path)
+        self.file = self.path.open("a" if append else "w")
+        self.count = 0
+
+    def write(self, result):
+        self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
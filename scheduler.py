@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+
+from metrics import Metrics
+
+logger = logging.getLogger("photolocationfinder.scheduler")
+
+# Per-API limits: "concurrency" is the number of requests in flight, "rate" is requests per second
+DEFAULT_API_LIMITS = {
+    "vision": {"concurrency": 8, "rate": 10},
+    "geocoding": {"concurrency": 10, "rate": 40},
+    "places_text_search": {"concurrency": 5, "rate": 10},
+    "place_details": {"concurrency": 5, "rate": 10},
+    "street_view": {"concurrency": 10, "rate": 40},
+}
+
+MAX_BACKOFF_SECONDS = 60
+END_OF_ITEMS = object()
+
+
+class RateLimitedError(Exception):
+    pass
+
+
+RATE_LIMIT_ERRORS = (RateLimitedError, ResourceExhausted, TooManyRequests)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ApiLimiter:
+    def __init__(self, name, concurrency, rate, metrics=None):
+        self.name = name
+        self.metrics = metrics or Metrics()
+        self.max_rate = rate
+        self.min_rate = rate / 10
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate)
+        self.backoff = 0
+        self.paused_until = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.bucket.acquire()
+            self.in_flight += 1
+            self.calls += 1
+            self.metrics.count_api(self.name, "calls")
+            start = time.perf_counter()
+            try:
+                yield
+            except RATE_LIMIT_ERRORS:
+                self.metrics.count_api(self.name, "throttled")
+                self.on_throttled()
+                raise
+            except Exception:
+                self.metrics.count_api(self.name, "errors")
+                raise
+            else:
+                self.on_success()
+            finally:
+                self.in_flight -= 1
+                # Only the request itself is timed, not the wait for a slot or a token
+                self.metrics.observe(self.name, time.perf_counter() - start)
+        finally:
+            self.semaphore.release()
+
+    def on_throttled(self):
+        # Multiplicative decrease: halve the rate and pause the API for a growing interval
+        self.throttled += 1
+        self.backoff = min(max(self.backoff * 2, 1), MAX_BACKOFF_SECONDS)
+        self.paused_until = max(self.paused_until, time.monotonic() + self.backoff)
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        logger.warning("%s throttled, backing off %ss at %.1f req/s", self.name, self.backoff, self.bucket.rate)
+
+    def on_success(self):
+        # Additive increase back towards the configured rate
+        self.backoff = self.backoff // 2
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 20)
+
+
+class Run:
+    # Progress of one call to Scheduler.run; a long-lived processor can have several going at once
+    def __init__(self, queue):
+        self.queue = queue
+        self.producing = True
+        self.total = 0
+        self.completed = 0
+        self.started_at = time.monotonic()
+
+
+class Scheduler:
+    def __init__(self, api_limits=None, progress_interval=10, metrics=None):
+        limits = {name: dict(values) for name, values in DEFAULT_API_LIMITS.items()}
+        for name, values in (api_limits or {}).items():
+            limits.setdefault(name, {}).update(values)
+        self.metrics = metrics or Metrics()
+        self.limiters = {name: ApiLimiter(name, **values, metrics=self.metrics) for name, values in limits.items()}
+        self.progress_interval = progress_interval
+
+    def limit(self, api):
+        return self.limiters[api].slot()
+
+    async def run(self, items, handler, concurrency, weight=lambda item: 1):
+        # Items can be a list or an async iterator that is still producing them (such as a directory scan).
+        # The bounded queue keeps the producer just ahead of the workers.
+        workers = max(1, min(concurrency, len(items)) if isinstance(items, list) else concurrency)
+        queue = asyncio.Queue(maxsize=workers * 2)
+        run = Run(queue)
+
+        async def put(item):
+            run.total += weight(item)
+            await queue.put(item)
+
+        async def produce():
+            if hasattr(items, "__aiter__"):
+                async for item in items:
+                    await put(item)
+            else:
+                for item in items:
+                    await put(item)
+            run.producing = False
+            await queue.put(END_OF_ITEMS)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is END_OF_ITEMS:
+                    # Passed on so that every worker sees it
+                    queue.put_nowait(END_OF_ITEMS)
+                    return
+                await handler(item)
+                run.completed += weight(item)
+
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(workers)]
+        if self.progress_interval:
+            tasks.append(asyncio.create_task(self.report_progress(run)))
+        try:
+            await asyncio.gather(*tasks[:workers + 1])
+        finally:
+            # When one task fails (or the run is cancelled) the others would otherwise keep going on their own
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            run.producing = False
+        logger.info(self.status_line(run))
+
+    async def report_progress(self, run):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logger.info(self.status_line(run))
+
+    def status_line(self, run):
+        elapsed = time.monotonic() - run.started_at
+        throughput = run.completed / elapsed if elapsed else 0
+        queue_depth = run.queue.qsize()
+        apis = ", ".join(
+            f"{limiter.name}: {limiter.calls} calls/{limiter.in_flight} in flight/"
+            f"{limiter.waiting} waiting/{limiter.throttled} throttled"
+            for limiter in self.limiters.values() if limiter.calls or limiter.waiting
+        )
+        # A "+" after the total means the input is still being scanned
+        return (f"Progress: {run.completed}/{run.total}{'+' if run.producing else ''} images, queue depth {queue_depth}, "
+                f"{throughput:.1f} images/s" + (f" | {apis}" if apis else ""))
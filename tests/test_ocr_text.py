@@ -0,0 +1,66 @@
+from google.cloud.vision_v1 import types
+
+from benchmarks.stubs import make_document_text_annotation
+from ocr_text import extract_ocr_text, score_phrase, select_location_text, words_with_boxes
+
+MENU = "\n".join([
+    "Café Crème 3,50 € Croissant 2,10 € Tartine 4,80 €",
+    "Open daily 9:00 - 23:45 except holidays",
+    "12 Rue Cler 75007 Paris",
+    "Tel +33 1 45 55 12 34 www.example-bistro.com",
+])
+
+
+def test_address_scores_above_place_name():
+    assert score_phrase("12 Rue Cler 75007 Paris") > score_phrase("Gare du Nord") > 0
+
+
+def test_prices_hours_and_contact_details_score_below_zero():
+    assert score_phrase("Café Crème 3,50 € Croissant 2,10 €") < 0
+    assert score_phrase("Open daily 9:00 - 23:45") < 0
+    assert score_phrase("Tel +33 1 45 55 12 34 www.example-bistro.com") < 0
+
+
+def test_numbers_alone_score_nothing():
+    assert score_phrase("12 34") == 0
+
+
+def test_menu_sends_only_the_address():
+    assert select_location_text(MENU) == "12 Rue Cler 75007 Paris"
+
+
+def test_sign_lines_are_ranked_and_deduplicated():
+    assert select_location_text("EXIT\nGare du Nord\nEXIT\nGare du Nord") == "Gare du Nord, EXIT"
+
+
+def test_text_without_place_words_is_kept_in_reading_order():
+    assert select_location_text("please wait to be seated\nthank you") == "please wait to be seated, thank you"
+
+
+def test_empty_text():
+    assert select_location_text("") == ""
+    assert select_location_text("\n \n") == ""
+
+
+def test_over_length_text_is_cut_at_phrase_boundaries():
+    text = "Rue " + " ".join(f"Word{i}" for i in range(100)) + "\n12 Rue Cler 75007 Paris"
+    selected = select_location_text(text, max_chars=60)
+    assert len(selected) <= 60
+    assert selected.startswith("12 Rue Cler 75007 Paris")
+    assert select_location_text("12 Rue Cler 75007 Paris\nGare du Nord", max_chars=30) == "12 Rue Cler 75007 Paris"
+
+
+def test_word_longer_than_the_limit_is_left_out():
+    assert select_location_text("Rue" + "x" * 200, max_chars=50) == ""
+
+
+def test_extract_keeps_words_paragraphs_and_boxes():
+    response = types.AnnotateImageResponse()
+    response.full_text_annotation = make_document_text_annotation(["Gare du Nord", "Paris"])
+
+    text, boxes = extract_ocr_text(response)
+
+    assert text == "Gare du Nord\nParis"
+    assert len(boxes) == 4 * 8
+    assert words_with_boxes(text, boxes)[1] == {"text": "du", "coords": [(12, 0), (22, 0), (22, 12), (12, 12)]}
+    assert extract_ocr_text(response, with_boxes=False) == (text, None)
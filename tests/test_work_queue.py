@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+from result_writer import ResultWriter, iter_results
+from work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"), lease_seconds=60, max_attempts=2, clock=clock)
+    yield queue
+    queue.close()
+
+
+def statuses(queue):
+    return {status: count for status, count in queue.counts().items() if count}
+
+
+def write_shard(queue, worker, results):
+    writer = ResultWriter(queue.shard_path(worker))
+    for result in results:
+        writer.write(result)
+    writer.close()
+
+
+def test_claim_leases_images_in_queue_order(queue):
+    queue.add([("a.jpg", 1, 1), ("b.jpg", 1, 1), ("c.jpg", 1, 1)])
+
+    assert queue.claim("w1", limit=2) == ["a.jpg", "b.jpg"]
+    assert queue.claim("w2", limit=2) == ["c.jpg"]
+    assert queue.claim("w3", limit=2) == []
+    assert statuses(queue) == {LEASED: 3}
+
+
+def test_expired_lease_is_claimed_by_another_worker(queue, clock):
+    queue.add([("a.jpg", 1, 1)])
+    queue.claim("w1")
+
+    clock.now += 30
+    assert queue.claim("w2") == []
+    clock.now += 31
+    assert queue.claim("w2") == ["a.jpg"]
+
+
+def test_renewed_lease_does_not_expire(queue, clock):
+    queue.add([("a.jpg", 1, 1)])
+    queue.claim("w1")
+
+    clock.now += 50
+    queue.renew("w1", ["a.jpg"])
+    clock.now += 50
+    assert queue.claim("w2") == []
+
+
+def test_image_fails_after_max_attempts_of_expired_leases(queue, clock):
+    queue.add([("a.jpg", 1, 1)])
+    queue.claim("w1")
+    clock.now += 61
+    queue.claim("w2")
+    clock.now += 61
+
+    assert queue.claim("w3") == []
+    assert statuses(queue) == {FAILED: 1}
+    assert queue.is_finished()
+
+
+def test_finish_from_stale_worker_is_ignored(queue, clock):
+    queue.add([("a.jpg", 1, 1)])
+    queue.claim("w1")
+    clock.now += 61
+    queue.claim("w2")
+
+    queue.finish("w1", [("a.jpg", None)])
+    assert statuses(queue) == {LEASED: 1}
+    queue.finish("w2", [("a.jpg", None)])
+    assert statuses(queue) == {DONE: 1}
+
+
+def test_failed_image_is_retried_until_max_attempts(queue):
+    queue.add([("a.jpg", 1, 1)])
+    queue.claim("w1")
+    queue.finish("w1", [("a.jpg", "timeout")])
+    assert statuses(queue) == {PENDING: 1}
+
+    queue.claim("w1")
+    queue.finish("w1", [("a.jpg", "timeout")])
+    assert statuses(queue) == {FAILED: 1}
+
+
+def test_queue_is_not_finished_while_producing(queue):
+    queue.set_producing(True)
+    assert not queue.is_finished()
+    queue.set_producing(False)
+    assert queue.is_finished()
+
+
+def test_add_requeues_only_changed_images(queue):
+    queue.add([("a.jpg", 1, 1), ("b.jpg", 1, 1)])
+    queue.claim("w1")
+    queue.finish("w1", [("a.jpg", None), ("b.jpg", None)])
+
+    queue.add([("a.jpg", 1, 1), ("b.jpg", 2, 1)])
+    assert statuses(queue) == {PENDING: 1, DONE: 1}
+    assert queue.claim("w2") == ["b.jpg"]
+
+
+def test_merge_keeps_the_result_of_the_worker_that_finished(queue, clock, tmp_path):
+    queue.add([("a.jpg", 1, 1), ("b.jpg", 1, 1)])
+    queue.claim("w1")
+    clock.now += 61
+    queue.claim("w2")
+    queue.finish("w2", [("a.jpg", None), ("b.jpg", "unreadable")])
+    # w1 lost its leases but still wrote results for both images before it stopped
+    write_shard(queue, "w1", [{"filename": "a.jpg", "stale": True}, {"filename": "b.jpg", "stale": True}])
+    write_shard(queue, "w2", [{"filename": "a.jpg"}, {"filename": "b.jpg", "error": "unreadable"}])
+
+    result_path = tmp_path / "result.jsonl"
+    assert queue.merge_results(result_path) == (["a.jpg"], ["b.jpg"])
+    assert list(iter_results(result_path)) == [{"filename": "a.jpg"}, {"filename": "b.jpg", "error": "unreadable"}]
+
+
+def test_merge_reports_failed_images_without_a_result(queue, clock, tmp_path):
+    queue.add([("a.jpg", 1, 1)])
+    queue.claim("w1")
+    clock.now += 61
+    queue.claim("w1")
+    clock.now += 61
+    queue.claim("w2")
+
+    result_path = tmp_path / "result.jsonl"
+    assert queue.merge_results(result_path) == ([], ["a.jpg"])
+    assert json.loads(result_path.read_text()) == {"error": "lease expired", "filename": "a.jpg"}
+
+
+def test_resumed_queue_merges_only_new_outcomes(queue, tmp_path):
+    queue.add([("a.jpg", 1, 1), ("b.jpg", 1, 1)])
+    queue.claim("w1")
+    queue.finish("w1", [("a.jpg", None), ("b.jpg", None)])
+    write_shard(queue, "w1", [{"filename": "a.jpg"}, {"filename": "b.jpg"}])
+    result_path = tmp_path / "result.jsonl"
+    assert queue.merge_results(result_path) == (["a.jpg", "b.jpg"], [])
+
+    # Resumed with nothing new, then with b.jpg changed
+    assert queue.merge_results(result_path, append=True) == ([], [])
+    queue.add([("a.jpg", 1, 1), ("b.jpg", 2, 1)])
+    queue.claim("w2")
+    queue.finish("w2", [("b.jpg", None)])
+    write_shard(queue, "w2", [{"filename": "b.jpg", "changed": True}])
+    assert queue.merge_results(result_path, append=True) == (["b.jpg"], [])
+
+    assert len(result_path.read_text().splitlines()) == 3
+    assert list(iter_results(result_path)) == [{"filename": "a.jpg"}, {"filename": "b.jpg", "changed": True}]
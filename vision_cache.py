@@ -0,0 +1,95 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from google.cloud.vision_v1 import types
+
+DEFAULT_VISION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class VisionCache:
+    def __init__(self, path, max_bytes=DEFAULT_VISION_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.accessed = {}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS vision_annotations (
+                key TEXT PRIMARY KEY,
+                response BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vision_last_access ON vision_annotations(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM vision_annotations").fetchone()[0]
+
+    @staticmethod
+    def make_key(content_hash, request, variant=""):
+        # The same bytes annotated with a different feature set or preprocessing is a different entry
+        feature_names = sorted(types.Feature.Type(feature.type_).name for feature in request.features)
+        digest = hashlib.sha256(content_hash.encode())
+        digest.update(",".join(feature_names).encode())
+        digest.update(variant.encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM vision_annotations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Access times only matter for eviction, so they are written with the next put (or on close)
+            # rather than costing a disk sync per hit
+            self.accessed[key] = time.time()
+        return types.AnnotateImageResponse.deserialize(row[0])
+
+    def write_access_times(self):
+        self.conn.executemany(
+            "UPDATE vision_annotations SET last_access = ? WHERE key = ?",
+            [(last_access, key) for key, last_access in self.accessed.items()]
+        )
+        self.accessed.clear()
+
+    def put(self, key, response):
+        data = types.AnnotateImageResponse.serialize(response)
+        with self.lock:
+            self.write_access_times()
+            previous = self.conn.execute("SELECT size FROM vision_annotations WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO vision_annotations (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time())
+            )
+            self.total_bytes += len(data) - (previous[0] if previous else 0)
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        # Least recently used entries go first until the cache fits its budget again
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM vision_annotations ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM vision_annotations WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def summary(self):
+        return f"Vision cache: {self.hits} hits, {self.misses} misses ({self.total_bytes / (1024 * 1024):.1f} MB stored)"
+
+    def close(self):
+        with self.lock:
+            self.write_access_times()
+            self.conn.commit()
+            self.conn.close()
@@ -1,9 +1,22 @@
 import os
 import json
-import asyncio
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory
+import math
+import atexit
+import secrets
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, send_from_directory, send_file, abort, jsonify
+from itsdangerous import BadSignature, URLSafeSerializer
 from werkzeug.utils import secure_filename
-from photolocationfinder import ImageProcessor
+from photolocationfinder import (DEFAULT_FEATURE_PROFILE, DEFAULT_MAPS_API_URL, DEFAULT_PLACES_API_URL,
+                                 DEFAULT_STREET_VIEW_DIR, DEFAULT_VISION_BATCH_MAX_BYTES, VISION_FEATURE_PROFILES,
+                                 ImageProcessor)
+from job_queue import DEFAULT_MAX_CONCURRENT_JOBS, FINISHED_STATUSES, JobQueue
+from metrics import METRIC_PREFIX, configure_logging
+from ocr_text import DEFAULT_LOCATION_TEXT_MAX_CHARS, DEFAULT_OCR_FORMAT
+from result_writer import iter_results
 
 app = Flask(__name__, static_folder='static')
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'fallback_secret_key')
@@ -40,15 +53,92 @@ placeholder_values = [
 if any(value in config.values() for value in placeholder_values):
     print(f"Warning: {config_path} contains placeholder values. Please edit it with your actual configuration.")
 
+configure_logging(config.get('log_level', 'info'))
+
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit for single images
+
+STREET_VIEW_MODE = config.get('street_view_mode', 'inline')
+STREET_VIEW_DIR = config.get('street_view_dir', DEFAULT_STREET_VIEW_DIR)
+FEATURE_PROFILE = config.get('feature_profile', DEFAULT_FEATURE_PROFILE)
+MAX_CONCURRENT_JOBS = config.get('web_max_concurrent_jobs', DEFAULT_MAX_CONCURRENT_JOBS)
+# Batch uploads (several files or zip archives) have their own, larger limits
+BATCH_MAX_BYTES = config.get('web_batch_max_bytes', 1024 * 1024 * 1024)
+BATCH_MAX_FILES = config.get('web_batch_max_files', 1000)
+RESULTS_PER_PAGE = 20
+STREET_VIEW_TIMEOUT = 60
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def create_processor():
+    return ImageProcessor(
+        api_key=config['google_api_key'],
+        cred_path=config['google_application_credentials_file_path'],
+        image_dir=app.config['UPLOAD_FOLDER'],
+        prompt_for_confirmation=False,
+        batch_size=config.get('vision_batch_size', 1),
+        batch_max_bytes=config.get('vision_batch_max_bytes', DEFAULT_VISION_BATCH_MAX_BYTES),
+        street_view_mode=STREET_VIEW_MODE,
+        street_view_dir=STREET_VIEW_DIR,
+        feature_profile=FEATURE_PROFILE,
+        maps_api_url=config.get('maps_api_url', DEFAULT_MAPS_API_URL),
+        places_api_url=config.get('places_api_url', DEFAULT_PLACES_API_URL),
+        ocr_format=config.get('ocr_format', DEFAULT_OCR_FORMAT),
+        location_text_max_chars=config.get('location_text_max_chars', DEFAULT_LOCATION_TEXT_MAX_CHARS)
+    )
+
+job_queue = None
+job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    # Started on first use so the debug reloader's parent process doesn't start a worker too
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(create_processor(), MAX_CONCURRENT_JOBS)
+            atexit.register(job_queue.shutdown)
+        return job_queue
+
+async def fetch_street_view(processor, lat, lng):
+    await processor.initialize()
+    return await processor.save_street_view(lat, lng)
+
+@app.context_processor
+def inject_feature_profiles():
+    return {'feature_profiles': list(VISION_FEATURE_PROFILES), 'default_feature_profile': FEATURE_PROFILE}
+
+# Street View links carry a signed location, so the route can't be used to download imagery
+# for arbitrary coordinates with the server's API key. The fallback secret key is public, so
+# without FLASK_SECRET_KEY links are signed with a random key that only this process knows.
+STREET_VIEW_SECRET_KEY = os.environ.get('FLASK_SECRET_KEY')
+if STREET_VIEW_MODE == 'lazy' and not STREET_VIEW_SECRET_KEY:
+    print("Warning: FLASK_SECRET_KEY is not set. Street View links will stop working when the server restarts "
+          "and won't work across several server processes.")
+street_view_signer = URLSafeSerializer(STREET_VIEW_SECRET_KEY or secrets.token_bytes(32), salt='street-view')
+
+def street_view_url(street_view):
+    if isinstance(street_view, str):
+        return f"data:image/jpeg;base64,{street_view}"
+    if STREET_VIEW_MODE == 'lazy':
+        return url_for('serve_street_view', token=street_view_signer.dumps([street_view['lat'], street_view['lng']]))
+    if STREET_VIEW_MODE == 'file' and street_view.get('file'):
+        return url_for('serve_street_view_file', filename=Path(street_view['file']).name)
+    return None
+
+def result_for_page(result):
+    result = dict(result)
+    upload_path = Path(os.path.relpath(result['filename'], app.config['UPLOAD_FOLDER'])).as_posix()
+    result['image_url'] = url_for('serve_upload', filename=upload_path)
+    if result.get('street_view'):
+        url = street_view_url(result['street_view'])
+        if url:
+            result['street_view_url'] = url
+    return result
+
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory(app.static_folder, filename)
@@ -57,6 +147,260 @@ def serve_static(filename):
 def serve_upload(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+def valid_coordinates(lat, lng):
+    return (all(isinstance(value, (int, float)) and math.isfinite(value) for value in (lat, lng))
+            and -90 <= lat <= 90 and -180 <= lng <= 180)
+
+if STREET_VIEW_MODE == 'lazy':
+    @app.route('/street_view/<token>')
+    def serve_street_view(token):
+        try:
+            lat, lng = street_view_signer.loads(token)
+        except (BadSignature, TypeError, ValueError):
+            abort(404)
+        if not valid_coordinates(lat, lng):
+            abort(404)
+        queue = get_job_queue()
+        # The first view downloads the image, later ones are served from disk
+        path = queue.processor.street_view_path(lat, lng)
+        if not path.exists():
+            try:
+                street_view = queue.run(fetch_street_view(queue.processor, lat, lng), timeout=STREET_VIEW_TIMEOUT)
+            except TimeoutError:
+                # The download goes on in the background and the next view will find the file
+                abort(503)
+            except Exception:
+                app.logger.exception("Street View download failed")
+                abort(503)
+            if not street_view:
+                abort(404)
+        return send_file(os.path.abspath(path), mimetype='image/jpeg')
+
+if STREET_VIEW_MODE == 'file':
+    @app.route('/street_view/<path:filename>')
+    def serve_street_view_file(filename):
+        # Only images saved while processing are served; nothing is downloaded here
+        return send_from_directory(os.path.abspath(STREET_VIEW_DIR), filename, mimetype='image/jpeg')
+
+def save_upload(file, job_id):
+    # The job ID prefix keeps concurrent uploads with the same name apart
+    filename = f"{job_id}_{secure_filename(file.filename)}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    file.save(filepath)
+    return filepath
+
+def requested_feature_profile():
+    feature_profile = request.form.get('feature_profile', FEATURE_PROFILE)
+    if feature_profile not in VISION_FEATURE_PROFILES:
+        feature_profile = FEATURE_PROFILE
+    return feature_profile
+
+def submit_upload(file):
+    feature_profile = requested_feature_profile()
+    queue = get_job_queue()
+    job_id = queue.new_job_id()
+    filepath = save_upload(file, job_id)
+    return queue.submit(filepath, job_id=job_id, feature_profile=feature_profile)
+
+def unique_path(directory, filename):
+    # Archives often contain the same file name in different folders
+    path = os.path.join(directory, filename)
+    stem, ext = os.path.splitext(filename)
+    index = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem}_{index}{ext}")
+        index += 1
+    return path
+
+def extract_zip(archive_path, batch_dir, image_paths, budget):
+    # Members are copied out one by one and their uncompressed total is capped, so an archive can't fill the disk
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.infolist():
+            if member.is_dir() or not allowed_file(member.filename):
+                continue
+            filename = secure_filename(member.filename)
+            if not filename:
+                continue
+            if len(image_paths) >= BATCH_MAX_FILES:
+                raise ValueError(f"A batch can contain at most {BATCH_MAX_FILES} images")
+            budget -= member.file_size
+            if budget < 0:
+                raise ValueError(f"The extracted images exceed the batch limit of {BATCH_MAX_BYTES} bytes")
+            path = unique_path(batch_dir, filename)
+            with archive.open(member) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            image_paths.append(path)
+    return budget
+
+def save_batch(files, batch_dir):
+    image_paths = []
+    budget = BATCH_MAX_BYTES
+    for file in files:
+        if file.filename.lower().endswith('.zip'):
+            # Large uploads are already spooled to a temporary file by the form parser and copied from there in chunks
+            fd, archive_path = tempfile.mkstemp(suffix='.zip', dir=batch_dir)
+            os.close(fd)
+            try:
+                file.save(archive_path)
+                budget = extract_zip(archive_path, batch_dir, image_paths, budget)
+            except zipfile.BadZipFile:
+                raise ValueError(f"{file.filename} is not a valid zip archive")
+            finally:
+                os.remove(archive_path)
+        elif allowed_file(file.filename):
+            if len(image_paths) >= BATCH_MAX_FILES:
+                raise ValueError(f"A batch can contain at most {BATCH_MAX_FILES} images")
+            path = unique_path(batch_dir, secure_filename(file.filename))
+            file.save(path)
+            image_paths.append(path)
+    if not image_paths:
+        raise ValueError("No images found in the upload")
+    return image_paths
+
+def submit_batch_upload():
+    # Raised for this request only, before the form is parsed; single image uploads keep MAX_CONTENT_LENGTH
+    request.max_content_length = BATCH_MAX_BYTES
+    request.max_form_parts = BATCH_MAX_FILES + 10
+    files = [file for file in request.files.getlist('files') if file.filename]
+    feature_profile = requested_feature_profile()
+    queue = get_job_queue()
+    job_id = queue.new_job_id()
+    batch_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+    os.makedirs(batch_dir)
+    try:
+        image_paths = save_batch(files, batch_dir)
+    except ValueError:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+    result_path = os.path.join(batch_dir, 'result.jsonl')
+    return queue.submit_batch(image_paths, result_path, job_id=job_id, feature_profile=feature_profile)
+
+def read_result_page(path, page, per_page):
+    results = []
+    total = 0
+    for index, result in enumerate(iter_results(path)):
+        if (page - 1) * per_page <= index < page * per_page:
+            results.append(result)
+        total += 1
+    return results, total
+
+def job_status(job):
+    status = {
+        'id': job['id'],
+        'status': job['status'],
+        'filename': os.path.basename(job['filename']) if job['filename'] else None,
+        'error': job['error'],
+        'status_url': url_for('get_job_status', job_id=job['id']),
+        'result_url': url_for('get_job_result', job_id=job['id']),
+        'events_url': url_for('job_events', job_id=job['id']),
+        'page_url': url_for('show_job', job_id=job['id'])
+    }
+    if job.get('batch'):
+        status.update(total=job['total'], completed=job['completed'],
+                      export_url=url_for('export_job_results', job_id=job['id']))
+    return status
+
+def job_event(job):
+    event = {'status': job['status']}
+    if job.get('batch'):
+        event.update(completed=job['completed'], total=job['total'])
+    return event
+
+def get_job_or_404(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    file = request.files.get('file')
+    if file is None or file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'An image file is required'}), 400
+    job_id = submit_upload(file)
+    return jsonify(job_status(get_job_queue().get(job_id))), 202
+
+@app.route('/batches', methods=['POST'])
+def create_batch_job():
+    try:
+        job_id = submit_batch_upload()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(job_status(get_job_queue().get(job_id))), 202
+
+@app.route('/jobs/<job_id>/status')
+def get_job_status(job_id):
+    return jsonify(job_status(get_job_or_404(job_id)))
+
+@app.route('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = get_job_or_404(job_id)
+    if job['status'] not in FINISHED_STATUSES:
+        return jsonify(job_status(job)), 202
+    if job['status'] != 'done':
+        return jsonify(job_status(job)), 500
+    if not job.get('batch'):
+        return jsonify(job['result'])
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max(1, request.args.get('per_page', RESULTS_PER_PAGE, type=int)), 1000)
+    results, total = read_result_page(job['result_path'], page, per_page)
+    return jsonify({'page': page, 'per_page': per_page, 'total': total, 'results': results})
+
+@app.route('/jobs/<job_id>/export')
+def export_job_results(job_id):
+    job = get_job_or_404(job_id)
+    if not job.get('batch'):
+        abort(404)
+    if job['status'] not in FINISHED_STATUSES:
+        return jsonify(job_status(job)), 202
+
+    def stream():
+        # Results are streamed from the JSON Lines file so a large batch is never held in memory
+        yield '['
+        for index, result in enumerate(iter_results(job['result_path'])):
+            yield (',\n' if index else '\n') + json.dumps(result)
+        yield '\n]\n'
+
+    return Response(stream(), mimetype='application/json',
+                    headers={'Content-Disposition': f'attachment; filename="{job_id}.json"'})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = get_job_or_404(job_id)
+    queue = get_job_queue()
+
+    def stream(job):
+        yield f"data: {json.dumps(job_event(job))}\n\n"
+        while job and job['status'] not in FINISHED_STATUSES:
+            changed = queue.wait_for_change(job_id, job['status'], timeout=15, completed=job.get('completed'))
+            if changed is None or job_event(changed) == job_event(job):
+                # Comment lines keep idle connections from being closed by proxies
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(job_event(changed))}\n\n"
+            job = changed
+
+    return Response(stream(job), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/jobs/<job_id>')
+def show_job(job_id):
+    job = get_job_or_404(job_id)
+    if job['status'] == 'failed':
+        error_message = f"Error processing image: {job['error']}"
+        app.logger.error(error_message)
+        flash(error_message)
+        return render_template('upload.html', error=error_message)
+    if job['status'] != 'done':
+        return render_template('job.html', job=job_status(job))
+    if job.get('batch'):
+        page = max(1, request.args.get('page', 1, type=int))
+        results, total = read_result_page(job['result_path'], page, RESULTS_PER_PAGE)
+        pages = max(1, -(-total // RESULTS_PER_PAGE))
+        return render_template('batch_result.html', job=job_status(job),
+                               results=[result_for_page(result) for result in results],
+                               page=page, pages=pages, total=total)
+    return render_template('result.html', result=result_for_page(job['result']))
+
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
@@ -68,29 +412,28 @@ def upload_file():
             flash('No selected file')
             return redirect(request.url)
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            processor = ImageProcessor(
-                api_key=config['google_api_key'],
-                cred_path=config['google_application_credentials_file_path'],
-                image_dir=app.config['UPLOAD_FOLDER'],
-                prompt_for_confirmation=False
-            )
-            try:
-                result = processor.process_single_image(filepath)
-                if isinstance(result, dict) and 'error' in result:
-                    raise Exception(result['error'])
-                result['image_url'] = url_for('serve_upload', filename=filename)
-                return render_template('result.html', result=result)
-            except Exception as e:
-                error_message = f"Error processing image: {str(e)}"
-                app.logger.error(error_message)
-                flash(error_message)
-                return render_template('upload.html', error=error_message)
+            job_id = submit_upload(file)
+            return redirect(url_for('show_job', job_id=job_id))
     return render_template('upload.html')
 
+@app.route('/batch', methods=['POST'])
+def upload_batch():
+    try:
+        job_id = submit_batch_upload()
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('upload_file'))
+    return redirect(url_for('show_job', job_id=job_id))
+
+@app.route('/metrics')
+def metrics():
+    queue = get_job_queue()
+    name = f"{METRIC_PREFIX}_jobs"
+    lines = [f"# HELP {name} Web jobs currently held by the job queue, by status.", f"# TYPE {name} gauge"]
+    lines += [f'{name}{{status="{status}"}} {count}' for status, count in queue.status_counts().items()]
+    body = queue.processor.metrics.prometheus() + "\n".join(lines) + "\n"
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(413)
 def too_large(e):
     return "File is too large", 413
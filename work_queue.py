@@ -0,0 +1,202 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from result_writer import ResultWriter, iter_results
+
+DEFAULT_WORK_QUEUE_PATH = 'work_queue.sqlite3'
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_CLAIM_SIZE = 16
+DEFAULT_POLL_INTERVAL = 2
+# Scanned images are queued in groups of this many, so workers can start before the scan is done
+ADD_BATCH_SIZE = 200
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    # Workers lease a few images at a time. A lease that isn't renewed expires, so the images of a
+    # worker that died go to another one; an image is given up after max_attempts.
+    def __init__(self, path=DEFAULT_WORK_QUEUE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, clock=time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Lease expiry is wall-clock time, since it is compared between processes and machines
+        self.clock = clock
+        # Every worker appends its results to its own file next to the queue
+        self.shard_dir = Path(path).with_suffix(".shards")
+        self.lock = threading.Lock()
+        # No WAL: it needs shared memory, which network filesystems don't provide across nodes.
+        # Transactions are started explicitly so that claiming is atomic between processes.
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_expires REAL,
+                error TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                merged INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tasks)")]
+        # Queue files from earlier versions lack the newer columns
+        added_columns = (("size", "INTEGER"), ("mtime_ns", "INTEGER"), ("merged", "INTEGER NOT NULL DEFAULT 0"))
+        for column, definition in added_columns:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def transaction(self, statements):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def reset(self):
+        def statements():
+            self.conn.execute("DELETE FROM tasks")
+            self.conn.execute("DELETE FROM state")
+        self.transaction(statements)
+        if self.shard_dir.exists():
+            for path in self.shard_dir.iterdir():
+                path.unlink()
+
+    def set_producing(self, producing):
+        # Until the coordinator has queued every image, an empty queue doesn't mean the run is over
+        self.transaction(lambda: self.conn.execute(
+            "INSERT OR REPLACE INTO state (key, value) VALUES ('producing', ?)", (str(int(producing)),)))
+
+    def add(self, files):
+        # files are (path, size, mtime_ns). When a resumed run queues an image again, it is only
+        # processed again if the file has changed since; otherwise it keeps its status.
+        return self.transaction(lambda: self.conn.executemany(
+            "INSERT INTO tasks (path, size, mtime_ns) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET status = ?, attempts = 0, worker = NULL, lease_expires = NULL, "
+            "error = NULL, merged = 0, size = excluded.size, mtime_ns = excluded.mtime_ns "
+            "WHERE size IS NOT excluded.size OR mtime_ns IS NOT excluded.mtime_ns",
+            [(path, size, mtime_ns, PENDING) for path, size, mtime_ns in files]).rowcount)
+
+    def claim(self, worker, limit=DEFAULT_CLAIM_SIZE):
+        def statements():
+            now = self.clock()
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, error = 'lease expired' "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts)
+            )
+            paths = [row[0] for row in self.conn.execute(
+                "SELECT path FROM tasks WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY rowid LIMIT ?",
+                (PENDING, LEASED, now, limit)
+            )]
+            self.conn.executemany(
+                "UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE path = ?",
+                [(LEASED, worker, now + self.lease_seconds, path) for path in paths]
+            )
+            return paths
+        return self.transaction(statements)
+
+    def renew(self, worker, paths):
+        expires = self.clock() + self.lease_seconds
+        self.transaction(lambda: self.conn.executemany(
+            "UPDATE tasks SET lease_expires = ? WHERE path = ? AND worker = ? AND status = ?",
+            [(expires, path, worker, LEASED) for path in paths]
+        ))
+
+    def finish(self, worker, outcomes):
+        # outcomes are (path, error) pairs; a worker whose lease has been taken over can't finish the image
+        def statements():
+            for path, error in outcomes:
+                if error is None:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = ?, lease_expires = NULL, error = NULL "
+                        "WHERE path = ? AND worker = ? AND status = ?", (DONE, path, worker, LEASED))
+                else:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires = NULL, "
+                        "error = ? WHERE path = ? AND worker = ? AND status = ?",
+                        (self.max_attempts, FAILED, PENDING, error, path, worker, LEASED))
+        self.transaction(statements)
+
+    def counts(self):
+        with self.lock:
+            counts = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+            counts.update(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"))
+            return counts
+
+    def is_finished(self):
+        with self.lock:
+            producing = self.conn.execute("SELECT value FROM state WHERE key = 'producing'").fetchone()
+            open_tasks = self.conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (PENDING, LEASED)).fetchone()[0]
+        return open_tasks == 0 and (producing is None or producing[0] == "0")
+
+    def shard_path(self, worker, suffix=".jsonl"):
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        return self.shard_dir / f"{worker}{suffix}"
+
+    def shards(self):
+        return sorted(self.shard_dir.glob("*.jsonl")) if self.shard_dir.exists() else []
+
+    def merge_results(self, result_path, append=False, result_store=None):
+        # A shard can hold earlier failed attempts, or results of a worker whose lease expired;
+        # only the outcome the queue recorded for each image is kept. The rows workers wrote to their
+        # own result stores are copied into result_store for the same images. Outcomes merged by an
+        # earlier run of a resumed queue are left out; returns the images done and failed in this one.
+        with self.lock:
+            outcomes = {path: (worker, status, error) for path, worker, status, error in self.conn.execute(
+                "SELECT path, worker, status, error FROM tasks WHERE status IN (?, ?) AND merged = 0", (DONE, FAILED))}
+        merged = set()
+        done = []
+        failed = [path for path, (_, status, _) in outcomes.items() if status == FAILED]
+        writer = ResultWriter(result_path, append=append)
+        try:
+            for shard in self.shards():
+                shard_done = []
+                for result in iter_results(shard):
+                    path = result.get("filename")
+                    worker, status, _ = outcomes.get(path, (None, None, None))
+                    if worker != shard.stem or path in merged or ("error" in result) != (status == FAILED):
+                        continue
+                    writer.write(result)
+                    merged.add(path)
+                    if status == DONE:
+                        shard_done.append(path)
+                store_path = shard.with_suffix(".sqlite3")
+                if result_store is not None and store_path.exists():
+                    result_store.merge(store_path, shard_done)
+                done += shard_done
+            # Images whose last worker died while holding them have no result in any shard
+            for path, (_, status, error) in outcomes.items():
+                if status == FAILED and path not in merged:
+                    writer.write({"error": error, "filename": path})
+        finally:
+            writer.close()
+        self.transaction(lambda: self.conn.executemany(
+            "UPDATE tasks SET merged = 1 WHERE path = ?", [(path,) for path in outcomes]))
+        return done, failed
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"